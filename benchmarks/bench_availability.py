@@ -0,0 +1,148 @@
+# SQL statements and latency of signups with and without the availability filter
+#
+#   python -m benchmarks.bench_availability --users 20000 --signups 300
+#
+# a database of --users existing accounts is seeded into a temporary directory, then every
+# signup replays what a signup form does: the availability of the username is polled as
+# it is typed (one call per character from the third on), the email once, and the signup
+# is posted. --taken of the signups first try a username that already exists and poll
+# again with a new one. the same flows run with the filter off (every check is a query)
+# and on (only possible hits are), bcrypt runs at its lowest cost so hashing doesn't
+# drown the rest
+#
+# on a 1 vCPU container with the defaults:
+#   off  availability calls 3570  sql/call 1.00  signup sql 4.0  call p50 1.6ms
+#   on   availability calls 3570  sql/call 0.07  signup sql 2.0  call p50 0.6ms
+#   saved 3915 of 4770 statements (82%), filter 1.1MB for 41k entries
+# signup checks both the username and the email, with the filter off that is two
+# queries before the insert and the refresh (the old single existing_user check only
+# looked at the username)
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import string
+import tempfile
+import time
+
+import httpx
+
+PASSWORD = "password"
+
+
+def signup_flows(count: int, existing: int, taken: float, rng: random.Random, tag: str) -> list[dict]:
+    flows = []
+    for index in range(count):
+        username = f"{tag}{''.join(rng.choices(string.ascii_lowercase, k=rng.randint(6, 10)))}{index}"
+        tries = [username]
+        if rng.random() < taken:
+            # benchmarks.seed names its users user1..userN
+            tries.insert(0, f"user{rng.randint(1, existing)}")
+        flows.append({"tries": tries, "email": f"{username}@example.com"})
+    return flows
+
+
+async def run_flows(client: httpx.AsyncClient, flows: list[dict], sql_totals: dict) -> dict:
+    call_latencies = []
+    call_sql = 0
+    signup_sql = 0
+    errors = 0
+    for flow in flows:
+        for username in flow["tries"]:
+            for length in range(3, len(username) + 1):
+                before = sql_totals["statements"]
+                start = time.perf_counter()
+                response = await client.get("/v1/auth/availability", params={"username": username[:length]})
+                call_latencies.append(time.perf_counter() - start)
+                call_sql += sql_totals["statements"] - before
+                errors += response.status_code != 200
+        before = sql_totals["statements"]
+        start = time.perf_counter()
+        await client.get("/v1/auth/availability", params={"email": flow["email"]})
+        call_latencies.append(time.perf_counter() - start)
+        call_sql += sql_totals["statements"] - before
+
+        username = flow["tries"][-1]
+        before = sql_totals["statements"]
+        response = await client.post(
+            "/v1/auth/signup",
+            json={
+                "email": flow["email"],
+                "username": username,
+                "name": username,
+                "password": PASSWORD,
+                "dob": "1990-01-01",
+            },
+        )
+        signup_sql += sql_totals["statements"] - before
+        errors += response.status_code != 201
+    return {
+        "calls": len(call_latencies),
+        "call_sql": call_sql,
+        "signup_sql": signup_sql,
+        "call_p50_ms": statistics.median(call_latencies) * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000, help="accounts that exist already")
+    parser.add_argument("--signups", type=int, default=300, help="signup flows per mode")
+    parser.add_argument("--taken", type=float, default=0.2, help="share of flows trying a taken name first")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "availability.db")
+        # the app builds its engines from DATABASE_URL on import, so it goes first
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+        from .seed import seed_database
+
+        seed_database(db_path, users=args.users, posts=100, hashtags=10, likes=0, follows_count=0)
+
+        from passlib.context import CryptContext
+
+        from src.auth.availability import availability_filter
+        from src.auth.hashing import password_hasher
+        from src.main import app
+        from src.metrics import sql_totals
+
+        password_hasher.context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+
+        async def run():
+            results = {}
+            async with app.router.lifespan_context(app):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                    # both modes replay the same flows, only the first letter of the names differs
+                    for mode, enabled, tag in (("off", False, "x"), ("on", True, "y")):
+                        availability_filter.enabled = enabled
+                        rng = random.Random(args.seed)
+                        flows = signup_flows(args.signups, args.users, args.taken, rng, tag)
+                        results[mode] = await run_flows(client, flows, sql_totals)
+                stats = availability_filter.stats()
+            return results, stats
+
+        results, stats = asyncio.run(run())
+
+    for mode, result in results.items():
+        print(
+            f"{mode:>4} availability calls {result['calls']}"
+            f"  sql/call {result['call_sql'] / result['calls']:.2f}"
+            f"  signup sql {result['signup_sql'] / args.signups:.1f}"
+            f"  call p50 {result['call_p50_ms']:.1f}ms  errors {result['errors']}"
+        )
+    off, on = results["off"], results["on"]
+    total_off = off["call_sql"] + off["signup_sql"]
+    total_on = on["call_sql"] + on["signup_sql"]
+    print(
+        f"saved {total_off - total_on} of {total_off} statements ({(total_off - total_on) / total_off:.0%}),"
+        f" filter {stats['bytes'] / 2**20:.1f}MB for {stats['entries']} entries"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Login throughput and feed latency while logins are running
+# compares bcrypt on the event loop (workers=0) against the password hash pool
+#
+#   python -m benchmarks.bench_login --logins 8 --seconds 5
+#
+# runs fully in process against a throwaway sqlite database
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.api import router
+from src.auth import service as auth_service
+from src.auth.hashing import PasswordHasher, pwd_context
+from src.database import Base, get_db, get_read_db
+
+
+def build_app(db_path: str) -> FastAPI:
+    Base.metadata.create_all(bind=create_engine(f"sqlite:///{db_path}"))
+    SessionLocal = async_sessionmaker(
+        create_async_engine(f"sqlite+aiosqlite:///{db_path}"),
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+    async def override_get_db():
+        async with SessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    return app
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(int(len(ordered) * pct / 100), len(ordered) - 1)
+    return ordered[index]
+
+
+async def run(app: FastAPI, logins: int, seconds: float) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post(
+            "/v1/auth/signup",
+            json={
+                "email": "bench@example.com",
+                "username": "bench",
+                "name": "Bench",
+                "password": "password",
+                "dob": "1990-01-01",
+            },
+        )
+        deadline = time.perf_counter() + seconds
+        login_count = 0
+        feed_latencies = []
+
+        async def login_loop():
+            nonlocal login_count
+            while time.perf_counter() < deadline:
+                response = await client.post(
+                    "/v1/auth/login", data={"username": "bench", "password": "password"}
+                )
+                if response.status_code == 201:
+                    login_count += 1
+
+        async def feed_loop():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get("/v1/posts/feed/posts")
+                feed_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(feed_loop(), *(login_loop() for _ in range(logins)))
+
+    return {
+        "logins_per_sec": login_count / seconds,
+        "feed_requests": len(feed_latencies),
+        "feed_p50_ms": statistics.median(feed_latencies) * 1000 if feed_latencies else 0.0,
+        "feed_p99_ms": percentile(feed_latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=8, help="concurrent login loops")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    for label, workers in (("inline", 0), ("pool", args.workers)):
+        with tempfile.TemporaryDirectory() as tmp:
+            hasher = PasswordHasher(pwd_context, workers, queue_size=args.logins * 2)
+            auth_service.password_hasher = hasher
+            result = asyncio.run(run(build_app(os.path.join(tmp, "bench.db")), args.logins, args.seconds))
+            hasher.shutdown()
+        print(
+            f"{label:>6} workers={workers:<3} logins/s={result['logins_per_sec']:7.1f} "
+            f"feed n={result['feed_requests']:<5} p50={result['feed_p50_ms']:7.1f}ms "
+            f"p99={result['feed_p99_ms']:7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Serialization time of one 100 post page, old paths against the projection + orjson path
+#
+#   python -m benchmarks.bench_serialization --posts 100 --repeat 500
+#
+# only the step from query result to response bytes is timed, the queries run once up front
+
+import argparse
+import json
+import timeit
+from datetime import date
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session, selectinload
+
+from src.auth.models import User
+from src.database import Base
+from src.post.models import Hashtag, Post
+from src.post.schemas import ShowPost
+from src.post.service import POST_COLUMNS, _to_show_post
+
+
+def seed(session: Session, count: int):
+    user = User(
+        email="bench@example.com",
+        username="bench",
+        name="Bench",
+        password="x",
+        dob=date(1990, 1, 1),
+    )
+    hashtags = [Hashtag(name=f"tag{i}") for i in range(5)]
+    session.add(user)
+    session.add_all(hashtags)
+    for i in range(count):
+        session.add(
+            Post(
+                content=f"post number {i} #tag{i % 5}",
+                image=f"https://example.com/{i}.jpg",
+                location="Lagos",
+                author=user,
+                hashtags=[hashtags[i % 5]],
+                user_liked=[user],
+            )
+        )
+    session.commit()
+
+
+# what FastAPI did before, jsonable_encoder walking the copied ORM __dict__
+def feed_before(rows) -> bytes:
+    results = []
+    for post, username in rows:
+        post_dict = post.__dict__.copy()
+        post_dict["username"] = username
+        results.append(post_dict)
+    return json.dumps(jsonable_encoder(results)).encode()
+
+
+def feed_after(rows) -> bytes:
+    return orjson.dumps([row._asdict() for row in rows])
+
+
+# ShowPost models validated per row and then again by response_model
+def show_posts_before(posts) -> bytes:
+    models = [ShowPost.model_validate(_to_show_post(post)) for post in posts]
+    return json.dumps(jsonable_encoder(models)).encode()
+
+
+def show_posts_after(posts) -> bytes:
+    return orjson.dumps([_to_show_post(post) for post in posts])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        seed(session, args.posts)
+        entity_rows = session.execute(select(Post, User.username).join(User)).all()
+        projected_rows = session.execute(select(*POST_COLUMNS, User.username).join(User)).all()
+        posts = session.scalars(
+            select(Post).options(
+                selectinload(Post.author),
+                selectinload(Post.hashtags),
+                selectinload(Post.user_liked),
+            )
+        ).all()
+
+        cases = [
+            ("feed      before", lambda: feed_before(entity_rows)),
+            ("feed      after ", lambda: feed_after(projected_rows)),
+            ("show_post before", lambda: show_posts_before(posts)),
+            ("show_post after ", lambda: show_posts_after(posts)),
+        ]
+        for label, func in cases:
+            seconds = min(timeit.repeat(func, number=args.repeat, repeat=3)) / args.repeat
+            print(f"{label} {seconds * 1000:8.3f} ms per {args.posts} post page")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Memory and lookup time of the hashtag suggestion index against a LIKE query
+#
+#   python -m benchmarks.bench_suggest --tags 1000000
+#
+# the index is built from random names of 4 to 12 characters with Zipf distributed post
+# counts, its memory is measured with tracemalloc (the names, the list and the counts)
+# the baseline is sqlite on an indexed (name, count) table, WHERE name LIKE 'pre%'
+# ORDER BY count DESC LIMIT 10, which is cheaper than the real query that has to
+# count post_hashtags as well
+#
+# on a 1 vCPU container with 1M tags:
+#   memory     ~70 bytes a tag, ~66MB per million (name ~57, list slot 8, count 4)
+#   suggest    1 letter 9us (cached, 5ms to rank the first time)  2 letters 120us
+#              3 letters 16us  5 letters 7us
+#   LIKE       1 letter 41ms  2 letters 1.3ms  3 letters 67us  5 letters 25us
+#   add        new tag 0.3ms (the list and the array move up to 1M slots), known tag 5us
+
+import argparse
+import random
+import sqlite3
+import string
+import time
+import tracemalloc
+
+from src.post.suggest import HashtagSuggestions
+
+
+def random_tags(count: int, rng: random.Random) -> list[tuple[str, int]]:
+    alphabet = string.ascii_lowercase + string.digits
+    names = set()
+    while len(names) < count:
+        names.add("".join(rng.choices(alphabet[:26], k=1) + rng.choices(alphabet, k=rng.randint(3, 11))))
+    counts = [int(100000 / rank**1.1) + 1 for rank in range(1, count + 1)]
+    rng.shuffle(counts)
+    return list(zip(names, counts))
+
+
+def timed(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tags", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=200, help="lookups timed per prefix length")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    tracemalloc.start()
+    rows = random_tags(args.tags, rng)
+    suggestions = HashtagSuggestions(scan_limit=2000, cache_size=1000, cache_seconds=30)
+    before, _ = tracemalloc.get_traced_memory()
+    suggestions.load(rows)
+    # only what the index keeps, the names are shared with rows so count them here
+    index_bytes = tracemalloc.get_traced_memory()[0] - before + sum(
+        name.__sizeof__() for name, _ in rows
+    )
+    tracemalloc.stop()
+    per_tag = index_bytes / args.tags
+    print(
+        f"tags={args.tags} index={index_bytes / 2**20:.1f}MB per_tag={per_tag:.1f}B"
+        f" per_million={per_tag * 1e6 / 2**20:.1f}MB"
+    )
+
+    connection = sqlite3.connect(":memory:")
+    connection.execute("PRAGMA case_sensitive_like = OFF")
+    connection.execute("CREATE TABLE tags (name TEXT COLLATE NOCASE, count INTEGER)")
+    connection.executemany("INSERT INTO tags VALUES (?, ?)", rows)
+    connection.execute("CREATE INDEX ix_tags_name ON tags (name COLLATE NOCASE)")
+
+    names = [name for name, _ in rows]
+    for length in (1, 2, 3, 5):
+        prefixes = [rng.choice(names)[:length] for _ in range(args.lookups)]
+        # a short prefix is ranked once and then served from the cache
+        cold = timed(lambda: suggestions.suggest(prefixes[0]), 1) if length == 1 else 0.0
+        for prefix in set(prefixes):
+            suggestions.suggest(prefix)
+        index_time = timed(lambda: suggestions.suggest(rng.choice(prefixes)), args.lookups)
+        like_time = timed(
+            lambda: connection.execute(
+                "SELECT name, count FROM tags WHERE name LIKE ? ORDER BY count DESC LIMIT 10",
+                (rng.choice(prefixes) + "%",),
+            ).fetchall(),
+            max(args.lookups // 10, 5),
+        )
+        extra = f" first={cold * 1000:.1f}ms" if cold else ""
+        print(f"prefix={length} suggest={index_time * 1e6:8.1f}us like={like_time * 1e6:10.1f}us{extra}")
+
+    # spread over the whole list, a new tag at the end would move nothing
+    new_names = [f"{rng.choice(names)[:3]}{index}new" for index in range(100)]
+    print(f"add new={timed(lambda: suggestions.add([new_names.pop()]), 100) * 1e3:.2f}ms "
+          f"known={timed(lambda: suggestions.add([rng.choice(names)]), 1000) * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+# Load test of the whole app against a seeded database, fully in process and offline
+#
+#   python -m benchmarks.load --users 1000 --posts 20000 --concurrency 16 --seconds 20
+#   python -m benchmarks.load --db /tmp/load.db --json results.json
+#   python -m benchmarks.load --baseline results.json --fail-on-scan
+#
+# without --db a database is seeded into a temporary directory with benchmarks.seed
+# virtual users replay a weighted mix of calls (--mix) through httpx against the ASGI app,
+# lifespan and background tasks included, and each operation reports its throughput,
+# latency percentiles and SQL statements per request
+#
+# every distinct SELECT the run produced is checked with EXPLAIN QUERY PLAN and full
+# scans of a table are listed, so a query that lost its index shows up even when the
+# seeded data is too small for it to be slow yet
+# --baseline compares against an earlier --json and exits with 1 when an operation's
+# p95 or statement count went past the tolerance, --fail-on-scan does the same for scans
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+DEFAULT_MIX = "feed=30,timeline=15,hashtag=15,like=15,create_post=10,search=5,login=5,signup=5"
+
+_operation = contextvars.ContextVar("operation", default=None)
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(int(len(ordered) * pct / 100), len(ordered) - 1)
+    return ordered[index]
+
+
+# what a virtual user knows about the seeded data, ids are 1..n like seed.py writes them
+class Workload:
+    def __init__(self, db_path: str, rng: random.Random, zipf_s: float, active_users: int):
+        from .seed import PASSWORD, Zipf
+
+        with sqlite3.connect(db_path) as connection:
+            users, posts, hashtags = (
+                connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                for table in ("users", "posts", "hashtags")
+            )
+            words = [
+                row[0].split()[0]
+                for row in connection.execute("SELECT content FROM posts LIMIT 200")
+                if row[0]
+            ]
+        self.rng = rng
+        self.password = PASSWORD
+        self.users = Zipf(list(range(1, users + 1)), zipf_s, rng)
+        self.posts = Zipf(list(range(1, posts + 1)), zipf_s, rng)
+        self.hashtags = Zipf([f"tag{tag_id}" for tag_id in range(1, hashtags + 1)], zipf_s, rng)
+        self.words = words or ["post"]
+        self.active_users = list(range(1, min(active_users, users) + 1))
+        self.tokens: dict[int, str] = {}
+        self.signups = 0
+
+    async def token(self) -> str:
+        from src.auth.service import create_access_token
+
+        user_id = self.rng.choice(self.active_users)
+        if user_id not in self.tokens:
+            self.tokens[user_id] = await create_access_token(f"user{user_id}", user_id, None)
+        return self.tokens[user_id]
+
+
+async def op_feed(client, workload: Workload):
+    return await client.get("/v1/posts/feed/posts", params={"limit": 20})
+
+
+async def op_timeline(client, workload: Workload):
+    return await client.get(
+        "/v1/posts/feed", params={"token": await workload.token(), "limit": 20}
+    )
+
+
+async def op_hashtag(client, workload: Workload):
+    return await client.get(f"/v1/posts/hashtag/{workload.hashtags.sample()[0]}")
+
+
+async def op_like(client, workload: Workload):
+    post_id = workload.posts.sample()[0]
+    method = workload.rng.choice((client.post, client.delete))
+    return await method(f"/v1/posts/{post_id}/like", params={"token": await workload.token()})
+
+
+async def op_create_post(client, workload: Workload):
+    tags = " ".join(f"#{name}" for name in set(workload.hashtags.sample(workload.rng.randint(0, 3))))
+    content = " ".join(workload.rng.choices(workload.words, k=8))
+    return await client.post(
+        "/v1/posts/",
+        params={"token": await workload.token()},
+        json={"content": f"{content} {tags}", "image": "https://example.com/load.jpg"},
+    )
+
+
+async def op_search(client, workload: Workload):
+    return await client.get(
+        "/v1/posts/search", params={"q": workload.rng.choice(workload.words), "limit": 20}
+    )
+
+
+async def op_login(client, workload: Workload):
+    user_id = workload.users.sample()[0]
+    return await client.post(
+        "/v1/auth/login", data={"username": f"user{user_id}", "password": workload.password}
+    )
+
+
+async def op_signup(client, workload: Workload):
+    workload.signups += 1
+    name = f"load{os.getpid()}x{workload.signups}"
+    return await client.post(
+        "/v1/auth/signup",
+        json={
+            "email": f"{name}@example.com",
+            "username": name,
+            "name": "Load",
+            "password": workload.password,
+            "dob": "1990-01-01",
+        },
+    )
+
+
+OPERATIONS = {
+    "feed": op_feed,
+    "timeline": op_timeline,
+    "hashtag": op_hashtag,
+    "like": op_like,
+    "create_post": op_create_post,
+    "search": op_search,
+    "login": op_login,
+    "signup": op_signup,
+}
+
+
+# statements per operation and the first parameters every distinct SELECT ran with
+class SQLRecorder:
+    def __init__(self):
+        self.statements = defaultdict(int)
+        self.selects: dict[str, tuple] = {}
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        operation = _operation.get()
+        if operation is None:
+            return
+        self.statements[operation] += 1
+        if not executemany and statement.lstrip().upper().startswith("SELECT"):
+            self.selects.setdefault(statement, (operation, parameters))
+
+
+async def drive(app, workload: Workload, mix: dict, concurrency: int, seconds: float, warmup: float):
+    import httpx
+
+    names = list(mix)
+    weights = list(mix.values())
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as client:
+
+        async def virtual_user(deadline: float, record: bool):
+            while time.perf_counter() < deadline:
+                name = workload.rng.choices(names, weights)[0]
+                token = _operation.set(name if record else None)
+                start = time.perf_counter()
+                try:
+                    response = await OPERATIONS[name](client, workload)
+                finally:
+                    _operation.reset(token)
+                if not record:
+                    continue
+                if response.status_code < 400:
+                    latencies[name].append(time.perf_counter() - start)
+                else:
+                    errors[name] += 1
+
+        if warmup:
+            deadline = time.perf_counter() + warmup
+            await asyncio.gather(*(virtual_user(deadline, False) for _ in range(concurrency)))
+        started = time.perf_counter()
+        deadline = started + seconds
+        await asyncio.gather(*(virtual_user(deadline, True) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def explain_scans(db_path: str, selects: dict) -> list[dict]:
+    scans = []
+    with sqlite3.connect(db_path) as connection:
+        for statement, (operation, parameters) in selects.items():
+            try:
+                plan = connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            except sqlite3.Error:
+                continue
+            for *_, detail in plan:
+                # an index or the FTS index means it seeks, a bare SCAN reads the whole table
+                if detail.startswith("SCAN ") and "INDEX" not in detail and "VIRTUAL TABLE" not in detail:
+                    scans.append({"operation": operation, "plan": detail, "sql": " ".join(statement.split())})
+    return scans
+
+
+def report(latencies, errors, statements, elapsed: float) -> dict:
+    results = {}
+    for name in sorted(set(latencies) | set(errors)):
+        samples = latencies[name]
+        count = len(samples) + errors[name]
+        results[name] = {
+            "requests": count,
+            "errors": errors[name],
+            "rps": count / elapsed,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+            "mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0,
+            "sql_per_request": statements[name] / count if count else 0.0,
+        }
+    print(
+        f"{'operation':<12} {'requests':>8} {'errors':>6} {'rps':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8}"
+    )
+    for name, row in results.items():
+        print(
+            f"{name:<12} {row['requests']:>8} {row['errors']:>6} {row['rps']:>8.1f} "
+            f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['sql_per_request']:>8.1f}"
+        )
+    total = sum(row["requests"] for row in results.values())
+    print(f"{'total':<12} {total:>8} {sum(errors.values()):>6} {total / elapsed:>8.1f}")
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, row in results.items():
+        before = baseline.get("operations", {}).get(name)
+        if before is None:
+            continue
+        if row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f}ms -> {row['p95_ms']:.1f}ms")
+        # small drift comes from cache hits, a whole extra statement per request does not
+        if row["sql_per_request"] > before["sql_per_request"] * (1 + tolerance) + 0.5:
+            regressions.append(
+                f"{name}: sql/req {before['sql_per_request']:.1f} -> {row['sql_per_request']:.1f}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="seeded sqlite file, a fresh one is seeded when left out")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--hashtags", type=int, default=500)
+    parser.add_argument("--likes", type=int, default=100000)
+    parser.add_argument("--follows", type=int, default=20000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight,...")
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users")
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds run before measuring")
+    parser.add_argument("--active-users", type=int, default=200, help="users that write and read timelines")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-cache", action="store_true", help="turn the response cache off")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed growth over the baseline")
+    parser.add_argument("--fail-on-scan", action="store_true")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db or os.path.join(tmp, "load.db")
+        # the app builds its engines from DATABASE_URL on import, so it goes first
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+        if not args.db:
+            from .seed import seed_database
+
+            summary = seed_database(
+                db_path,
+                users=args.users,
+                posts=args.posts,
+                hashtags=args.hashtags,
+                likes=args.likes,
+                follows_count=args.follows,
+                zipf_s=args.zipf,
+                seed=args.seed,
+            )
+            print(f"seeded {summary['posts']} posts for {summary['users']} users in {summary['seconds']:.1f}s")
+
+        from sqlalchemy import event
+
+        from src.cache import MemoryCacheBackend, response_cache
+        from src.database import async_engine
+        from src.main import app
+
+        if args.no_cache:
+            response_cache.backend = MemoryCacheBackend(0)
+        recorder = SQLRecorder()
+        event.listen(async_engine.sync_engine, "before_cursor_execute", recorder.before_cursor_execute)
+        workload = Workload(db_path, random.Random(args.seed), args.zipf, args.active_users)
+
+        async def run():
+            async with app.router.lifespan_context(app):
+                return await drive(app, workload, mix, args.concurrency, args.seconds, args.warmup)
+
+        latencies, errors, elapsed = asyncio.run(run())
+        results = report(latencies, errors, recorder.statements, elapsed)
+        scans = explain_scans(db_path, recorder.selects)
+
+    if scans:
+        print(f"\nfull table scans in {len(scans)} statement(s):")
+        for scan in scans:
+            print(f"  [{scan['operation']}] {scan['plan']}\n      {scan['sql'][:200]}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"operations": results, "scans": scans, "args": vars(args)}, file, indent=2)
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"regression {regression}")
+        failed = bool(regressions)
+    if args.fail_on_scan and scans:
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
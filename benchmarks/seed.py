@@ -0,0 +1,242 @@
+# Fills a sqlite database with synthetic users, posts, hashtags, likes and follows
+#
+#   python -m benchmarks.seed --db /tmp/load.db --users 2000 --posts 50000 --likes 200000
+#
+# popularity is Zipf distributed like on a real network: a few authors write most
+# posts, a few hashtags are on most of them, a few posts get most likes and a few
+# accounts have most followers. rows go in with executemany in one transaction, the
+# counters, profile stats, timelines and the search index are built once at the end
+# every user's password is "password"
+
+import argparse
+import os
+import random
+import string
+import time
+from datetime import date, datetime, timedelta, timezone
+from itertools import accumulate
+
+from sqlalchemy import create_engine, func, insert, select, text, update
+
+from src.auth.hashing import pwd_context
+from src.auth.models import User, follows
+from src.auth.stats import repair_statements
+from src.config import CELEBRITY_FOLLOWER_THRESHOLD
+from src.database import Base
+from src.post.models import Hashtag, Post, post_hashtags, post_likes, timeline
+from src.post.search import create_search_index
+
+PASSWORD = "password"
+BATCH_SIZE = 10000
+
+
+# picks items where the one at rank k is 1/k**s as likely as the first
+class Zipf:
+    def __init__(self, items: list, s: float, rng: random.Random):
+        self.items = items
+        self.rng = rng
+        self.cum_weights = list(accumulate(1 / rank**s for rank in range(1, len(items) + 1)))
+
+    def sample(self, k: int = 1) -> list:
+        return self.rng.choices(self.items, cum_weights=self.cum_weights, k=k)
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(connection, table, rows):
+    for batch in _batches(rows):
+        connection.execute(insert(table), batch)
+
+
+def seed_database(
+    db_path: str,
+    users: int = 1000,
+    posts: int = 20000,
+    hashtags: int = 500,
+    likes: int = 100000,
+    follows_count: int = 20000,
+    zipf_s: float = 1.1,
+    days: int = 30,
+    seed: int = 42,
+) -> dict:
+    rng = random.Random(seed)
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    password = pwd_context.hash(PASSWORD)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    started = time.perf_counter()
+
+    user_ids = list(range(1, users + 1))
+    hashtag_ids = list(range(1, hashtags + 1))
+    authors = Zipf(user_ids, zipf_s, rng)
+    tags = Zipf(hashtag_ids, zipf_s, rng)
+    tag_names = {tag_id: f"tag{tag_id}" for tag_id in hashtag_ids}
+
+    with engine.begin() as connection:
+        _insert(
+            connection,
+            User.__table__,
+            (
+                {
+                    "id": user_id,
+                    "email": f"user{user_id}@example.com",
+                    "username": f"user{user_id}",
+                    "name": f"User {user_id}",
+                    "password": password,
+                    "dob": date(1990, 1, 1),
+                }
+                for user_id in user_ids
+            ),
+        )
+        _insert(
+            connection,
+            Hashtag.__table__,
+            ({"id": tag_id, "name": name} for tag_id, name in tag_names.items()),
+        )
+
+        post_tags = []
+        post_rows = []
+        for post_id, author_id in enumerate(authors.sample(posts), start=1):
+            names = sorted({tag_names[tag_id] for tag_id in tags.sample(rng.randint(0, 3))})
+            post_tags.append((post_id, names))
+            words = " ".join(
+                "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8)))
+                for _ in range(rng.randint(3, 12))
+            )
+            post_rows.append(
+                {
+                    "id": post_id,
+                    "content": " ".join([words, *(f"#{name}" for name in names)]),
+                    "image": f"https://example.com/{post_id}.jpg",
+                    "author_id": author_id,
+                    "created_dt": now - timedelta(seconds=rng.uniform(0, days * 86400)),
+                    "likes_count": 0,
+                }
+            )
+        _insert(connection, Post.__table__, post_rows)
+        name_ids = {name: tag_id for tag_id, name in tag_names.items()}
+        _insert(
+            connection,
+            post_hashtags,
+            (
+                {"post_id": post_id, "hashtags_id": name_ids[name]}
+                for post_id, names in post_tags
+                for name in names
+            ),
+        )
+
+        # likes and follows are unique pairs, a skewed sample repeats a lot so draw until
+        # there are enough or the attempts run out
+        popular_posts = Zipf(list(range(1, posts + 1)), zipf_s, rng)
+        like_pairs = set()
+        for _ in range(likes * 3):
+            if len(like_pairs) >= likes:
+                break
+            like_pairs.add((rng.choice(user_ids), popular_posts.sample()[0]))
+        _insert(
+            connection,
+            post_likes,
+            ({"user_id": user_id, "post_id": post_id} for user_id, post_id in like_pairs),
+        )
+
+        follow_pairs = set()
+        for _ in range(follows_count * 3):
+            if len(follow_pairs) >= follows_count:
+                break
+            follower_id, followee_id = rng.choice(user_ids), authors.sample()[0]
+            if follower_id != followee_id:
+                follow_pairs.add((follower_id, followee_id))
+        _insert(
+            connection,
+            follows,
+            (
+                {"follower_id": follower_id, "followee_id": followee_id, "created_dt": now}
+                for follower_id, followee_id in follow_pairs
+            ),
+        )
+
+        # counters and the materialized timeline the api would have kept up on the way
+        connection.execute(
+            update(Post).values(
+                likes_count=select(func.count())
+                .select_from(post_likes)
+                .where(post_likes.c.post_id == Post.id)
+                .scalar_subquery()
+            )
+        )
+        # follower counts and the profile stats come from the same recount as the repair job
+        for statement in repair_statements(1, users):
+            connection.execute(statement)
+        connection.execute(
+            insert(timeline).from_select(
+                ["user_id", "post_id", "created_dt"],
+                select(Post.author_id, Post.id, Post.created_dt),
+            )
+        )
+        connection.execute(
+            insert(timeline).from_select(
+                ["user_id", "post_id", "created_dt"],
+                select(follows.c.follower_id, Post.id, Post.created_dt)
+                .join(Post, Post.author_id == follows.c.followee_id)
+                .join(User, User.id == follows.c.followee_id)
+                .where(User.followers_count <= CELEBRITY_FOLLOWER_THRESHOLD),
+            )
+        )
+    create_search_index(engine)
+    with engine.connect() as connection:
+        connection.execute(text("ANALYZE"))
+    engine.dispose()
+
+    return {
+        "users": users,
+        "posts": posts,
+        "hashtags": hashtags,
+        "likes": len(like_pairs),
+        "follows": len(follow_pairs),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="sqlite file to create, must not exist yet")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--hashtags", type=int, default=500)
+    parser.add_argument("--likes", type=int, default=100000)
+    parser.add_argument("--follows", type=int, default=20000)
+    parser.add_argument("--zipf", type=float, default=1.1, help="skew of the popularity")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} already exists")
+
+    summary = seed_database(
+        args.db,
+        users=args.users,
+        posts=args.posts,
+        hashtags=args.hashtags,
+        likes=args.likes,
+        follows_count=args.follows,
+        zipf_s=args.zipf,
+        seed=args.seed,
+    )
+    print(
+        " ".join(
+            f"{name}={value:.1f}" if isinstance(value, float) else f"{name}={value}"
+            for name, value in summary.items()
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class ActivityType(str, Enum):
+    LIKE = "like"
+    POST = "post"
+    FOLLOW = "follow"
@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, DateTime, Enum, ForeignKey, Index, Integer
+
+from ..database import Base
+from .enums import ActivityType
+
+
+# what happened to a user, written by the activity pipeline and never by a request
+class Activity(Base):
+    __tablename__ = "activities"
+
+    id = Column(Integer, primary_key=True)
+    # who gets notified
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # who did it
+    actor_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(Enum(ActivityType), nullable=False)
+    post_id = Column(Integer, ForeignKey("posts.id"))
+    created_dt = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    # a user's activity newest first with a (created_dt, id) cursor is one range scan
+    # and deleting a post finds its activities without a scan
+    __table_args__ = (
+        Index("ix_activities_user_id_created_dt_id", "user_id", "created_dt", "id"),
+        Index("ix_activities_post_id", "post_id"),
+    )
+
+
+# unread activities per user, bumped by the pipeline in the same batch as the rows
+class NotificationCounter(Base):
+    __tablename__ = "notification_counters"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    unread = Column(Integer, default=0, nullable=False, server_default="0")
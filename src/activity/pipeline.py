@@ -0,0 +1,228 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+from sqlalchemy import DateTime, insert, literal, select
+
+from ..auth.models import User, follows
+from ..config import (
+    ACTIVITY_BATCH_SIZE,
+    ACTIVITY_DRAIN_SECONDS,
+    ACTIVITY_ENQUEUE_TIMEOUT_MS,
+    ACTIVITY_QUEUE_SIZE,
+    CELEBRITY_FOLLOWER_THRESHOLD,
+)
+from ..database import AsyncSessionLocal, insert_or_add
+from ..post.models import Post
+from .enums import ActivityType
+from .models import Activity, NotificationCounter
+
+logger = logging.getLogger(__name__)
+
+activities_table = Activity.__table__
+counters_table = NotificationCounter.__table__
+
+
+class ActivityEvent(NamedTuple):
+    kind: ActivityType
+    actor_id: int
+    created_dt: datetime
+    post_id: Optional[int] = None
+    # who to notify when the producer knows it, likes are resolved to the post's author
+    user_id: Optional[int] = None
+
+
+# write behind pipeline for activities and notification counters
+# requests only put an event on a bounded queue, one worker takes whatever is queued
+# (up to batch_size) and writes it in a single transaction
+# a full queue makes requests wait a little for room before the event is dropped,
+# notifications are best effort and never fail or stall the like/post/follow itself
+class ActivityPipeline:
+    def __init__(
+        self,
+        session_factory,
+        maxsize: int,
+        batch_size: int,
+        enqueue_timeout: float,
+        drain_timeout: float,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.enqueue_timeout = enqueue_timeout
+        self.drain_timeout = drain_timeout
+        self._queue: asyncio.Queue[ActivityEvent] = asyncio.Queue(maxsize)
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.published = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.written = 0
+
+    async def publish(
+        self,
+        kind: ActivityType,
+        actor_id: int,
+        post_id: int = None,
+        user_id: int = None,
+    ) -> bool:
+        if self._closing:
+            self.dropped += 1
+            return False
+        event = ActivityEvent(
+            kind, actor_id, datetime.now(timezone.utc), post_id=post_id, user_id=user_id
+        )
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(event), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                return False
+        self.published += 1
+        return True
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self.write(batch)
+                self.batches += 1
+            except Exception:
+                self.failed += len(batch)
+                logger.exception("Failed to write %d activity events", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def write(self, batch: list[ActivityEvent]):
+        async with self.session_factory() as db:
+            authors = await self._post_authors(db, batch)
+            # events queued before their post was deleted are dropped here
+            batch = [event for event in batch if event.post_id is None or event.post_id in authors]
+            rows = self._direct_rows(batch, authors)
+            if rows:
+                await db.execute(insert(activities_table), rows)
+                unread = Counter(row["user_id"] for row in rows)
+                await db.execute(
+                    insert_or_add(db, counters_table, "user_id", "unread"),
+                    [{"user_id": user_id, "unread": count} for user_id, count in unread.items()],
+                )
+                self.written += len(rows)
+            posts = [event for event in batch if event.kind == ActivityType.POST]
+            if posts:
+                await self._notify_followers(db, posts)
+            await db.commit()
+
+    # the author of every post the batch refers to that still exists
+    async def _post_authors(self, db, batch: list[ActivityEvent]) -> dict[int, int]:
+        post_ids = {event.post_id for event in batch if event.post_id is not None}
+        if not post_ids:
+            return {}
+        return dict(
+            (await db.execute(select(Post.id, Post.author_id).where(Post.id.in_(post_ids)))).all()
+        )
+
+    # likes and follows notify one user each
+    def _direct_rows(self, batch: list[ActivityEvent], authors: dict[int, int]) -> list[dict]:
+        events = [event for event in batch if event.kind != ActivityType.POST]
+        rows = []
+        for event in events:
+            user_id = event.user_id if event.user_id is not None else authors.get(event.post_id)
+            # someone liked their own post
+            if user_id == event.actor_id:
+                continue
+            rows.append(
+                {
+                    "user_id": user_id,
+                    "actor_id": event.actor_id,
+                    "kind": event.kind,
+                    "post_id": event.post_id,
+                    "created_dt": event.created_dt,
+                }
+            )
+        return rows
+
+    # a new post notifies every follower of its author with INSERT ... SELECT, authors over
+    # the celebrity threshold are skipped like in the timeline fan-out
+    async def _notify_followers(self, db, posts: list[ActivityEvent]):
+        authors = set(
+            await db.scalars(
+                select(User.id).where(
+                    User.id.in_({event.actor_id for event in posts}),
+                    User.followers_count <= CELEBRITY_FOLLOWER_THRESHOLD,
+                )
+            )
+        )
+        for event in posts:
+            if event.actor_id not in authors:
+                continue
+            followers = follows.c.followee_id == event.actor_id
+            result = await db.execute(
+                insert(activities_table).from_select(
+                    ["user_id", "actor_id", "kind", "post_id", "created_dt"],
+                    select(
+                        follows.c.follower_id,
+                        literal(event.actor_id),
+                        literal(event.kind, activities_table.c.kind.type),
+                        literal(event.post_id),
+                        literal(event.created_dt, DateTime),
+                    ).where(followers),
+                )
+            )
+            self.written += result.rowcount
+            await db.execute(
+                insert_or_add(db, counters_table, "user_id", "unread").from_select(
+                    ["user_id", "unread"],
+                    select(follows.c.follower_id, literal(1)).where(followers),
+                )
+            )
+
+    def start(self):
+        self._closing = False
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # no new events after this, what is queued gets written unless it takes too long
+    async def stop(self):
+        self._closing = True
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%d activity events were not written", self._queue.qsize())
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "maxsize": self._queue.maxsize,
+            "published": self.published,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "written": self.written,
+        }
+
+
+activity_pipeline = ActivityPipeline(
+    AsyncSessionLocal,
+    ACTIVITY_QUEUE_SIZE,
+    ACTIVITY_BATCH_SIZE,
+    ACTIVITY_ENQUEUE_TIMEOUT_MS / 1000,
+    ACTIVITY_DRAIN_SECONDS,
+)
@@ -0,0 +1,18 @@
+from datetime import datetime
+from typing import List, Optional, TypedDict
+
+from .enums import ActivityType
+
+
+class ActivityRow(TypedDict):
+    id: int
+    kind: ActivityType
+    actor: str
+    post_id: Optional[int]
+    created_dt: datetime
+
+
+class ActivityPage(TypedDict):
+    activities: List[ActivityRow]
+    next_cursor: Optional[str]
+    unread: int
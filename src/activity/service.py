@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from sqlalchemy import desc, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth.models import User
+from ..pagination import decode_cursor, encode_cursor
+from .models import Activity, NotificationCounter
+from .schemas import ActivityPage
+
+
+# a user's activity newest first, the cursor is the (created_dt, id) of the last one
+async def get_activity_svc(
+    db: AsyncSession, user_id: int, limit: int = 20, cursor: str = None
+) -> ActivityPage:
+    query = (
+        select(
+            Activity.id,
+            Activity.kind,
+            User.username.label("actor"),
+            Activity.post_id,
+            Activity.created_dt,
+        )
+        .join(User, User.id == Activity.actor_id)
+        .where(Activity.user_id == user_id)
+    )
+    if cursor:
+        created_dt, activity_id = decode_cursor(cursor, datetime, int)
+        # a row value comparison so the cursor bounds the range of the index
+        query = query.where(
+            tuple_(Activity.created_dt, Activity.id) < tuple_(created_dt, activity_id)
+        )
+    rows = (
+        await db.execute(
+            query.order_by(desc(Activity.created_dt), desc(Activity.id)).limit(limit + 1)
+        )
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_dt, rows[-1].id)
+    unread = await db.scalar(
+        select(NotificationCounter.unread).where(NotificationCounter.user_id == user_id)
+    )
+    return {
+        "activities": [row._asdict() for row in rows],
+        "next_cursor": next_cursor,
+        "unread": unread or 0,
+    }
+
+
+async def mark_activity_read_svc(db: AsyncSession, user_id: int):
+    await db.execute(
+        update(NotificationCounter)
+        .where(NotificationCounter.user_id == user_id)
+        .values(unread=0)
+    )
+    await db.commit()
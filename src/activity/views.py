@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, Query, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth.service import get_current_user
+from ..database import get_db, get_read_db
+from .service import get_activity_svc, mark_activity_read_svc
+
+router = APIRouter(
+    prefix="/activity", tags=["activity"], default_response_class=ORJSONResponse
+)
+
+
+# likes on the user's posts, new followers and new posts of people they follow
+# activities are written in the background so the newest can be a moment behind
+@router.get("", status_code=status.HTTP_200_OK)
+async def get_activity(
+    token: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    user = await get_current_user(db, token)
+    return ORJSONResponse(await get_activity_svc(db, user.id, limit, cursor))
+
+
+# reset the unread count
+@router.post("/read", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_activity_read(token: str, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(db, token)
+    await mark_activity_read_svc(db, user.id)
@@ -1,5 +1,7 @@
 from fastapi import APIRouter
+from .activity.views import router as activity_router
 from .auth.views import router as auth_router
+from .media.views import router as media_router
 from .post.views import router as post_router
 
 
@@ -7,3 +9,5 @@ router = APIRouter(prefix="/v1")  # the version of the API
 
 router.include_router(auth_router)
 router.include_router(post_router)
+router.include_router(activity_router)
+router.include_router(media_router)
@@ -0,0 +1,125 @@
+import hashlib
+import math
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import (
+    AVAILABILITY_FILTER,
+    AVAILABILITY_FILTER_CAPACITY,
+    AVAILABILITY_FILTER_ERROR_RATE,
+)
+from . import schemas
+from .models import User
+
+
+# fixed size bit array with k positions per key, a key that was added always answers
+# True, one that wasn't answers False except for about error_rate of them
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    # double hashing, the k positions come from the two halves of one digest
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+# every username and email in use, in one set since logging in takes either and
+# existing_user matches a value against both columns
+# the filter only ever says "maybe taken" or "certainly free": a maybe goes to the
+# database, so renamed users (whose old name stays in the filter) cost a query, not
+# a wrong answer
+# each process has its own filter and only sees its own signups after startup, so
+# signup still relies on the unique constraints for names taken on another worker
+class AvailabilityFilter:
+    def __init__(self, capacity: int, error_rate: float, enabled: bool = True):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.enabled = enabled
+        self._filter = BloomFilter(capacity, error_rate)
+        self.checks = 0
+        self.skipped = 0
+        self.false_positives = 0
+
+    @staticmethod
+    def _normalize(value: str) -> str:
+        return value.strip().casefold()
+
+    def add(self, *values: str):
+        for value in values:
+            if value:
+                self._filter.add(self._normalize(value))
+
+    def might_exist(self, value: str) -> bool:
+        return not self.enabled or self._normalize(value) in self._filter
+
+    # whether a user has value as username or email, a query only on a possible hit
+    async def is_taken(self, db: AsyncSession, value: str) -> bool:
+        self.checks += 1
+        if not self.might_exist(value):
+            self.skipped += 1
+            return False
+        user_id = await db.scalar(
+            select(User.id).where(or_(User.username == value, User.email == value)).limit(1)
+        )
+        if user_id is None and self.enabled:
+            self.false_positives += 1
+        return user_id is not None
+
+    # sized for twice what is there so signups have room before the error rate climbs
+    async def rebuild(self, session_factory):
+        async with session_factory() as db:
+            users = await db.scalar(select(func.count()).select_from(User))
+            bloom = BloomFilter(max(self.capacity, users * 4), self.error_rate)
+            rows = await db.stream(
+                select(User.username, User.email).execution_options(yield_per=10000)
+            )
+            async for username, email in rows:
+                for value in (username, email):
+                    if value:
+                        bloom.add(self._normalize(value))
+        self._filter = bloom
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": self._filter.count,
+            "bytes": len(self._filter.bits),
+            "checks": self.checks,
+            "skipped": self.skipped,
+            "false_positives": self.false_positives,
+        }
+
+
+async def check_availability_svc(
+    db: AsyncSession, username: str = None, email: str = None
+) -> schemas.Availability:
+    result = {}
+    if username is not None:
+        result["username"] = not await availability_filter.is_taken(db, username)
+    if email is not None:
+        result["email"] = not await availability_filter.is_taken(db, email)
+    return result
+
+
+availability_filter = AvailabilityFilter(
+    AVAILABILITY_FILTER_CAPACITY, AVAILABILITY_FILTER_ERROR_RATE, enabled=AVAILABILITY_FILTER
+)
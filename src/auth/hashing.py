@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from ..config import PASSWORD_HASH_QUEUE, PASSWORD_HASH_WORKERS
+
+
+# bcrypt is deliberately slow (100ms+ per call) and would stall every other request
+# if it ran on the event loop, so hashing and verifying go to a bounded thread pool
+# bcrypt releases the GIL while it works so threads run it in parallel
+class PasswordHasher:
+    def __init__(self, context: CryptContext, workers: int, queue_size: int):
+        self.context = context
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = (
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+            if workers > 0
+            else None
+        )
+        self._lock = threading.Lock()
+        # calls handed to the pool that haven't finished yet, running or waiting
+        self._in_flight = 0
+        self._active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.monotonic()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            return self._timed(func, *args)
+        # past the queue depth shed the request instead of letting logins pile up
+        if self._in_flight >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, func, *args)
+        finally:
+            self._in_flight -= 1
+
+    def _timed(self, func, *args):
+        with self._lock:
+            self._active += 1
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._active -= 1
+                self.completed += 1
+                self.busy_seconds += elapsed
+
+    # pool utilization, busy_seconds over the uptime of every worker
+    def stats(self) -> dict:
+        uptime = time.monotonic() - self.started_at
+        capacity = max(self.workers, 1) * uptime
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "active": self._active,
+            "queued": max(self._in_flight - self._active, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "busy_seconds": self.busy_seconds,
+            "utilization": self.busy_seconds / capacity if capacity else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(pwd_context, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE)
@@ -8,8 +8,10 @@ from sqlalchemy import (
     Date,
     Enum,
     ForeignKey,
+    Index,
     Integer,
     String,
+    Table,
 )
 from sqlalchemy.orm import relationship, validates
 
@@ -17,6 +19,17 @@ from ..database import Base
 from ..post.models import post_likes
 from .enums import Gender
 
+# follower -> followee edges, the primary key answers "who does X follow"
+# and the reverse index "who follows X"
+follows = Table(
+    "follows",
+    Base.metadata,
+    Column("follower_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("followee_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("created_dt", DATETIME, default=lambda: datetime.now(timezone.utc)),
+    Index("ix_follows_followee_id_follower_id", "followee_id", "follower_id"),
+)
+
 
 # At the parent of the many to one
 # no foreign key but specify the relationship
@@ -36,6 +49,9 @@ class User(Base):
     profile_pic = Column(String)
     bio = Column(String)
     location = Column(String)
+    # kept in step with the follows table so nobody has to count it
+    followers_count = Column(Integer, default=0, nullable=False, server_default="0")
+    following_count = Column(Integer, default=0, nullable=False, server_default="0")
     posts = relationship("Post", back_populates="author")
 
     liked_post = relationship("Post", secondary=post_likes, back_populates="user_liked")
@@ -45,3 +61,14 @@ class User(Base):
         if dob >= date.today():
             raise ValueError("Date of birth must be in the past")
         return dob
+
+
+# counters shown on the user's own profile, kept apart from users so the writes from
+# every post and like don't land on the row the logins read
+class UserStats(Base):
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    posts_count = Column(Integer, default=0, nullable=False, server_default="0")
+    # likes on all of the user's posts
+    likes_received = Column(Integer, default=0, nullable=False, server_default="0")
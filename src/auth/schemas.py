@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field
 from .enums import Gender
-from typing import Optional
+from typing import List, Optional, TypedDict
 from datetime import datetime, date
 
 
@@ -65,5 +65,63 @@ class UserResults(BaseModel):
     profile_pic: Optional[str] = None
 
 
+# counters of the user's own profile, precomputed so the page doesn't count posts or likes
+class ProfileStats(BaseModel):
+    posts_count: int
+    likes_received: int
+    followers_count: int
+    following_count: int
+
+
+class ProfileResults(UserResults):
+    stats: ProfileStats
+
+
+# public profile anyone can look up, so nothing private like the email or dob
+# the counts are columns on users so reading them counts nothing
+class UserProfile(BaseModel):
+    username: str
+    name: str
+    bio: Optional[str] = None
+    profile_pic: Optional[str] = None
+    followers_count: int
+    following_count: int
+
+    class Config:
+        from_attributes = True
+
+
+class FollowUser(TypedDict):
+    id: int
+    username: str
+    name: str
+    profile_pic: Optional[str]
+
+
+class FollowPage(TypedDict):
+    users: List[FollowUser]
+    next_cursor: Optional[str]
+
+
+# only the fields that were asked about
+class Availability(TypedDict, total=False):
+    username: bool
+    email: bool
+
+
+class FollowRelation(TypedDict):
+    following: bool
+    followed_by: bool
+    mutual: bool
+
+
+# who the token belongs to, this is what get_current_user hands to the routes
+class CurrentUser(UserResults):
+    id: int
+
+    class Config:
+        from_attributes = True
+
+
 class TokenData(BaseModel):
     username: str | None = None
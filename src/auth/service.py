@@ -1,17 +1,26 @@
+import hashlib
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 from typing import Annotated, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import EmailStr
-from .models import User
-from sqlalchemy import or_
+from .models import User, follows
+from sqlalchemy import and_, case, delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
 from jwt.exceptions import InvalidTokenError
 import jwt
 from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
 from . import schemas
+from ..activity.enums import ActivityType
+from ..activity.pipeline import activity_pipeline
+from ..cache import LRUCache
+from ..config import IDENTITY_CACHE_SIZE
+from ..database import insert_or_ignore
+from ..pagination import decode_cursor, encode_cursor
+from .availability import availability_filter
+from .hashing import password_hasher
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
@@ -20,23 +29,41 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
 
+# verified tokens resolved to their user, keyed by a digest of the token so the raw
+# token is never kept around, each entry expires together with the token itself
+def _forget_token(digest: str, identity: schemas.CurrentUser):
+    tokens = _cached_tokens.get(identity.id)
+    if tokens is not None:
+        tokens.discard(digest)
+        if not tokens:
+            del _cached_tokens[identity.id]
+
+
+identity_cache = LRUCache(maxsize=IDENTITY_CACHE_SIZE, on_evict=_forget_token)
+# token digests cached per user id so an update can drop all of them
+_cached_tokens: dict[int, set[str]] = defaultdict(set)
+
+
+def invalidate_user_identity(user_id: int):
+    for digest in _cached_tokens.pop(user_id, ()):
+        identity_cache.delete(digest)
+
+
 # check if user already exists
-async def existing_user(db: Session, username: str):
+async def existing_user(db: AsyncSession, username: str):
     try:
-        db_user = (
-            db.query(User)
-            .filter((User.username == username) | (User.email == username))
-            .first()
+        result = await db.execute(
+            select(User).where((User.username == username) | (User.email == username))
         )
-        return db_user
+        return result.scalars().first()
     except Exception as e:
         return f"An error occurred at {e}"
 
 
 # get a user based on the username
-async def get_user(db: Session, username: str):
-    user = db.query(User).filter(User.username == username).first()
-    return user
+async def get_user(db: AsyncSession, username: str):
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
 
 
 async def create_access_token(
@@ -52,12 +79,16 @@ async def create_access_token(
     return encoded_jwt
 
 
-async def get_current_user(db: Session, token: Annotated[str, Depends(oauth2_scheme)]):
+async def get_current_user(db: AsyncSession, token: Annotated[str, Depends(oauth2_scheme)]):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    identity = identity_cache.get(digest)
+    if identity is not None:
+        return identity
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("username")
@@ -69,19 +100,23 @@ async def get_current_user(db: Session, token: Annotated[str, Depends(oauth2_sch
     user = await get_user(db, username=token_data.username)
     if user is None:
         raise credentials_exception
-    return user
+    identity = schemas.CurrentUser.model_validate(user)
+    if "exp" in payload:
+        identity_cache.set(digest, identity, expires_at=payload["exp"])
+        _cached_tokens[identity.id].add(digest)
+    return identity
 
 
-async def get_current_user_from_user_id(db: Session, id: int):
-    return db.query(User).filter(User.id == id).first()
+async def get_current_user_from_user_id(db: AsyncSession, id: int):
+    return await db.get(User, id)
 
 
-async def create_user(request: schemas.UserBase, db: Session):
+async def create_user(request: schemas.UserBase, db: AsyncSession):
     new_user = User(
         email=request.email,
         username=request.username,
         name=request.name,
-        password=pwd_context.hash(request.password),
+        password=await password_hasher.hash(request.password),
         gender=request.gender,
         location=request.location,
         profile_pic=request.profile_pic,
@@ -90,21 +125,30 @@ async def create_user(request: schemas.UserBase, db: Session):
         created_date=datetime.now(),  # set this internally and not on the user request
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    # the unique constraints settle two signups racing for the same name
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Username or Email already in use",
+        )
+    await db.refresh(new_user)
+    availability_filter.add(new_user.username, new_user.email)
     return new_user
 
 
-async def authenticate_user(db: Session, username: str, password: str):
+async def authenticate_user(db: AsyncSession, username: str, password: str):
     db_user = await existing_user(db, username)
     if not db_user:
         return None
-    elif not pwd_context.verify(password, db_user.password):
+    elif not await password_hasher.verify(password, db_user.password):
         return False
     return db_user
 
 
-async def update_user_svc(db: Session, username: str, request: schemas.UserUpdate):
+async def update_user_svc(db: AsyncSession, username: str, request: schemas.UserUpdate):
     db_user = await get_user(db, username)
     if not db_user:
         raise HTTPException(
@@ -114,6 +158,155 @@ async def update_user_svc(db: Session, username: str, request: schemas.UserUpdat
     for key, value in update_data.items():
         if value is not None:
             setattr(db_user, key, value)
-    db.commit()
-    db.refresh(db_user)
+    # a rename to a username another user has hits the unique constraint
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Username already in use",
+        )
+    await db.refresh(db_user)
+    # cached identities still carry the old username and profile
+    invalidate_user_identity(db_user.id)
+    availability_filter.add(db_user.username)
     return db_user
+
+
+# follow another user, following twice is a no-op
+# the counts only move when the edge was really added
+async def follow_user_svc(db: AsyncSession, follower_id: int, username: str) -> User:
+    followee = await get_user(db, username)
+    if not followee:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    if followee.id == follower_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="You can't follow yourself"
+        )
+    result = await db.execute(
+        insert_or_ignore(db, follows).values(
+            follower_id=follower_id,
+            followee_id=followee.id,
+            created_dt=datetime.now(timezone.utc),
+        )
+    )
+    if result.rowcount:
+        await _change_follow_counts(db, follower_id, followee.id, 1)
+    await db.commit()
+    if result.rowcount:
+        await activity_pipeline.publish(
+            ActivityType.FOLLOW, follower_id, user_id=followee.id
+        )
+    return followee
+
+
+async def unfollow_user_svc(db: AsyncSession, follower_id: int, username: str) -> User:
+    followee = await get_user(db, username)
+    if not followee:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    result = await db.execute(
+        delete(follows).where(
+            follows.c.follower_id == follower_id, follows.c.followee_id == followee.id
+        )
+    )
+    if result.rowcount:
+        await _change_follow_counts(db, follower_id, followee.id, -1)
+    await db.commit()
+    return followee
+
+
+# both sides of the edge in one relative UPDATE, in the same transaction as the edge
+async def _change_follow_counts(
+    db: AsyncSession, follower_id: int, followee_id: int, delta: int
+):
+    await db.execute(
+        update(User)
+        .where(User.id.in_([follower_id, followee_id]))
+        .values(
+            following_count=case(
+                (User.id == follower_id, User.following_count + delta),
+                else_=User.following_count,
+            ),
+            followers_count=case(
+                (User.id == followee_id, User.followers_count + delta),
+                else_=User.followers_count,
+            ),
+        )
+    )
+
+
+# followers of a user or the users they follow, one page at a time
+# each list is a range scan of one index of follows: the reverse index
+# (followee_id, follower_id) for followers and the primary key for following,
+# so pages are ordered by the other user's id and the cursor is the last id
+async def get_follow_list_svc(
+    db: AsyncSession, username: str, followers: bool, limit: int = 20, cursor: str = None
+) -> schemas.FollowPage:
+    user_id = await db.scalar(select(User.id).where(User.username == username))
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    if followers:
+        own_side, other_side = follows.c.followee_id, follows.c.follower_id
+    else:
+        own_side, other_side = follows.c.follower_id, follows.c.followee_id
+    query = (
+        select(other_side.label("id"), User.username, User.name, User.profile_pic)
+        .join(User, User.id == other_side)
+        .where(own_side == user_id)
+    )
+    if cursor:
+        (after,) = decode_cursor(cursor, int)
+        query = query.where(other_side > after)
+    rows = (await db.execute(query.order_by(other_side).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    return {"users": [row._asdict() for row in rows], "next_cursor": next_cursor}
+
+
+# whether two users follow each other, both edges come from one primary key lookup
+async def get_follow_relation_svc(
+    db: AsyncSession, username: str, other_username: str
+) -> schemas.FollowRelation:
+    ids = dict(
+        (
+            await db.execute(
+                select(User.username, User.id).where(
+                    User.username.in_([username, other_username])
+                )
+            )
+        ).all()
+    )
+    if username not in ids or other_username not in ids:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    user_id, other_id = ids[username], ids[other_username]
+    edges = set(
+        (
+            await db.execute(
+                select(follows.c.follower_id, follows.c.followee_id).where(
+                    or_(
+                        and_(follows.c.follower_id == user_id, follows.c.followee_id == other_id),
+                        and_(follows.c.follower_id == other_id, follows.c.followee_id == user_id),
+                    )
+                )
+            )
+        ).all()
+    )
+    following = (user_id, other_id) in edges
+    followed_by = (other_id, user_id) in edges
+    return {
+        "following": following,
+        "followed_by": followed_by,
+        "mutual": following and followed_by,
+    }
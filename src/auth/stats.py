@@ -0,0 +1,111 @@
+# Per user counters shown on /auth/profile, and the job that recounts them
+#
+#   python -m src.auth.stats
+#
+# the counters are moved with relative upserts by the post and like services, the job
+# recounts every user from the posts, post_likes and follows tables a batch of ids at
+# a time, run it after restoring a backup or whenever a counter looks off
+
+import asyncio
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import USER_STATS_REPAIR_BATCH_SIZE
+from ..database import AsyncSessionLocal, async_engine, engine, insert_or_add
+from ..post.models import Post, post_likes
+from . import schemas
+from .models import User, UserStats, follows
+
+user_stats_table = UserStats.__table__
+
+
+# e.g add_user_stats(db, author_id, posts_count=1), runs in the caller's transaction
+# a user without a row yet gets one holding the deltas
+async def add_user_stats(db: AsyncSession, user_id: int, **deltas: int):
+    await db.execute(
+        insert_or_add(db, user_stats_table, "user_id", *deltas).values(
+            user_id=user_id, **deltas
+        )
+    )
+
+
+# one primary key lookup, the follow counts already live on users
+async def get_user_stats_svc(db: AsyncSession, user_id: int) -> schemas.ProfileStats:
+    row = (
+        await db.execute(
+            select(
+                func.coalesce(UserStats.posts_count, 0).label("posts_count"),
+                func.coalesce(UserStats.likes_received, 0).label("likes_received"),
+                User.followers_count,
+                User.following_count,
+            )
+            .outerjoin(UserStats, UserStats.user_id == User.id)
+            .where(User.id == user_id)
+        )
+    ).one()
+    return schemas.ProfileStats.model_validate(row._asdict())
+
+
+# statements that recount the users with ids from first_id to last_id, each count is an
+# index range (posts by author, likes by post, follows both ways)
+def repair_statements(first_id: int, last_id: int) -> list:
+    in_range = User.id.between(first_id, last_id)
+    posts_count = (
+        select(func.count())
+        .select_from(Post)
+        .where(Post.author_id == User.id)
+        .scalar_subquery()
+    )
+    likes_received = (
+        select(func.count())
+        .select_from(post_likes)
+        .join(Post, Post.id == post_likes.c.post_id)
+        .where(Post.author_id == User.id)
+        .scalar_subquery()
+    )
+    return [
+        delete(UserStats).where(UserStats.user_id.between(first_id, last_id)),
+        insert(UserStats).from_select(
+            ["user_id", "posts_count", "likes_received"],
+            select(User.id, posts_count, likes_received).where(in_range),
+        ),
+        update(User)
+        .where(in_range)
+        .values(
+            followers_count=select(func.count())
+            .select_from(follows)
+            .where(follows.c.followee_id == User.id)
+            .scalar_subquery(),
+            following_count=select(func.count())
+            .select_from(follows)
+            .where(follows.c.follower_id == User.id)
+            .scalar_subquery(),
+        ),
+    ]
+
+
+# a transaction per batch so the counters of the other users stay writable meanwhile
+async def repair_user_stats(session_factory, batch_size: int) -> int:
+    async with session_factory() as db:
+        last_id = await db.scalar(select(func.max(User.id))) or 0
+    for first_id in range(1, last_id + 1, batch_size):
+        async with session_factory() as db:
+            for statement in repair_statements(first_id, first_id + batch_size - 1):
+                await db.execute(statement)
+            await db.commit()
+    return last_id
+
+
+async def main():
+    # the job may run against a database the api hasn't created the table in yet
+    user_stats_table.create(engine, checkfirst=True)
+    try:
+        users = await repair_user_stats(AsyncSessionLocal, USER_STATS_REPAIR_BATCH_SIZE)
+        print(f"recounted the stats of user ids up to {users}")
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,35 +1,46 @@
 # apis are defined APIS only
 # signing up
 # get current user
+# check availability
 # update user
 # reset password
+# follow and unfollow
 
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Query, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from .schemas import UserBase, UserUpdate, Token, UserResults, UserResponse
-from ..database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from .schemas import UserBase, UserUpdate, Token, ProfileResults, UserResponse, UserProfile
+from ..database import get_db, get_read_db
 from typing import Annotated
 from . import models
 from .service import (
     oauth2_scheme,
-    existing_user,
     create_access_token,
     get_current_user,
     authenticate_user,
     create_user as create_user_svc,
     update_user_svc,
+    follow_user_svc,
+    unfollow_user_svc,
+    get_user,
+    get_follow_list_svc,
+    get_follow_relation_svc,
 )
+from .availability import availability_filter, check_availability_svc
+from .stats import get_user_stats_svc
+from ..post.timeline import backfill_timeline_svc, remove_from_timeline_svc
 
-router = APIRouter(prefix="/auth", tags=["auth"])
+router = APIRouter(prefix="/auth", tags=["auth"], default_response_class=ORJSONResponse)
 
 
 # signup route
 @router.post("/signup", status_code=status.HTTP_201_CREATED)
-async def create_user(request: UserBase, db: Session = Depends(get_db)):
-    # check if user already exists
-    db_user = await existing_user(db, request.username)
-    if db_user:
+async def create_user(request: UserBase, db: AsyncSession = Depends(get_db)):
+    # check if user already exists, names that were never used skip the database
+    if await availability_filter.is_taken(
+        db, request.username
+    ) or await availability_filter.is_taken(db, request.email):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Username or Email already in use",
@@ -48,7 +59,7 @@ async def create_user(request: UserBase, db: Session = Depends(get_db)):
 @router.post("/login", status_code=status.HTTP_201_CREATED)
 async def login(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> Token:
     db_user = await authenticate_user(db, form_data.username, form_data.password)
     if not db_user:
@@ -61,11 +72,28 @@ async def login(
     return Token(access_token=access_token, token_type="bearer")
 
 
-# get current user
-@router.get("/profile", status_code=status.HTTP_200_OK, response_model=UserResults)
-async def get_current_active_user(token: str, db: Session = Depends(get_db)):
+# get current user with the counters of their profile
+# the user comes from the identity cache, the counters are always read fresh
+@router.get("/profile", status_code=status.HTTP_200_OK, response_model=ProfileResults)
+async def get_current_active_user(token: str, db: AsyncSession = Depends(get_read_db)):
     user = await get_current_user(db, token)
-    return user
+    return {**user.model_dump(), "stats": await get_user_stats_svc(db, user.id)}
+
+
+# whether a username and/or email can still be signed up with, for checking while typing
+# answered from memory for names nobody has, see AvailabilityFilter
+@router.get("/availability", status_code=status.HTTP_200_OK)
+async def check_availability(
+    username: str = Query(None, min_length=1),
+    email: str = Query(None, min_length=1),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if username is None and email is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Pass a username, an email or both",
+        )
+    return ORJSONResponse(await check_availability_svc(db, username, email))
 
 
 # update user
@@ -73,7 +101,7 @@ async def get_current_active_user(token: str, db: Session = Depends(get_db)):
 
 @router.put("/{username}", status_code=status.HTTP_204_NO_CONTENT)
 async def update_user(
-    username: str, token: str, request: UserUpdate, db: Session = Depends(get_db)
+    username: str, token: str, request: UserUpdate, db: AsyncSession = Depends(get_db)
 ):
     db_user = await get_current_user(db, token)
     if db_user.username != username:
@@ -83,3 +111,72 @@ async def update_user(
         )
     updated_user = await update_user_svc(db, username, request)
     return updated_user
+
+
+# follow a user, their recent posts get copied into the follower's feed in the background
+@router.post("/{username}/follow", status_code=status.HTTP_204_NO_CONTENT)
+async def follow_user(
+    username: str,
+    token: str,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+):
+    current_user = await get_current_user(db, token)
+    followee = await follow_user_svc(db, current_user.id, username)
+    background_tasks.add_task(backfill_timeline_svc, current_user.id, followee.id)
+
+
+@router.delete("/{username}/follow", status_code=status.HTTP_204_NO_CONTENT)
+async def unfollow_user(
+    username: str,
+    token: str,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+):
+    current_user = await get_current_user(db, token)
+    followee = await unfollow_user_svc(db, current_user.id, username)
+    background_tasks.add_task(remove_from_timeline_svc, current_user.id, followee.id)
+
+
+# public profile of any user with their follower and following counts
+@router.get("/{username}", status_code=status.HTTP_200_OK, response_model=UserProfile)
+async def get_user_profile(username: str, db: AsyncSession = Depends(get_read_db)):
+    user = await get_user(db, username)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    return user
+
+
+# pass the next_cursor of a page back as cursor to get the page after it
+@router.get("/{username}/followers", status_code=status.HTTP_200_OK)
+async def get_followers(
+    username: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    return ORJSONResponse(
+        await get_follow_list_svc(db, username, followers=True, limit=limit, cursor=cursor)
+    )
+
+
+@router.get("/{username}/following", status_code=status.HTTP_200_OK)
+async def get_following(
+    username: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    return ORJSONResponse(
+        await get_follow_list_svc(db, username, followers=False, limit=limit, cursor=cursor)
+    )
+
+
+# does username follow other_username, the other way round, or both
+@router.get("/{username}/relation/{other_username}", status_code=status.HTTP_200_OK)
+async def get_follow_relation(
+    username: str, other_username: str, db: AsyncSession = Depends(get_read_db)
+):
+    return ORJSONResponse(await get_follow_relation_svc(db, username, other_username))
@@ -0,0 +1,164 @@
+import time
+from collections import OrderedDict, defaultdict
+from typing import Iterable
+from urllib.parse import urlencode
+
+import orjson
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+from .config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS
+
+
+# in process LRU cache where every entry can carry its own expiry time
+# not thread safe, it is only touched from the event loop
+class LRUCache:
+    def __init__(self, maxsize: int, on_evict=None):
+        self.maxsize = maxsize
+        # called with (key, value) whenever an entry leaves the cache without delete()
+        self.on_evict = on_evict
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            self._evict(key)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    # expires_at is a unix timestamp, None keeps the entry until it gets pushed out
+    def set(self, key, value, expires_at: float = None):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._evict(next(iter(self._entries)))
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    # like delete but hands back the value, expired or not
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._entries.clear()
+
+    def _evict(self, key):
+        value, _ = self._entries.pop(key)
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# where rendered responses are stored, every entry is tagged with what it was built from
+# (e.g "post:12") so a write can drop exactly the entries it made stale
+# the in memory backend only serves one process, a shared store like redis
+# plugs in by implementing these methods
+class CacheBackend:
+    async def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float, tags: Iterable[str]):
+        raise NotImplementedError
+
+    async def invalidate(self, tags: Iterable[str]):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, maxsize: int):
+        self._entries = LRUCache(maxsize, on_evict=self._unlink)
+        self._keys_by_tag: dict[str, set[str]] = defaultdict(set)
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        return None if entry is None else entry[0]
+
+    async def set(self, key: str, value: bytes, ttl: float, tags: Iterable[str]):
+        tags = tuple(tags)
+        old_entry = self._entries.pop(key)
+        if old_entry is not None:
+            self._unlink(key, old_entry)
+        self._entries.set(key, (value, tags), expires_at=time.time() + ttl)
+        for tag in tags:
+            self._keys_by_tag[tag].add(key)
+
+    async def invalidate(self, tags: Iterable[str]):
+        for tag in tags:
+            for key in self._keys_by_tag.pop(tag, ()):
+                entry = self._entries.pop(key)
+                if entry is not None:
+                    self._unlink(key, entry)
+
+    def _unlink(self, key: str, entry: tuple):
+        for tag in entry[1]:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    def stats(self) -> dict:
+        return {**self._entries.stats(), "tags": len(self._keys_by_tag)}
+
+
+# read through cache of whole json responses
+# a hit sends the stored bytes as they are, no query and no serialization runs
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+
+    # route name plus its params, params that weren't given are left out
+    @staticmethod
+    def key(route: str, **params) -> str:
+        query = urlencode(
+            sorted((name, value) for name, value in params.items() if value is not None)
+        )
+        return f"{route}?{query}"
+
+    # render is an async function producing the content, tags picks the tags out of it
+    async def get_or_render(self, key: str, render, tags) -> Response:
+        body = await self.backend.get(key)
+        if body is None:
+            content = await render()
+            # rows are plain dicts and lists so orjson takes them directly,
+            # anything it doesn't know falls back to fastapi's encoder
+            body = orjson.dumps(content, default=jsonable_encoder)
+            await self.backend.set(key, body, self.ttl, tags(content))
+        return Response(content=body, media_type="application/json")
+
+    async def invalidate(self, *tags: str):
+        await self.backend.invalidate(tags)
+
+
+response_cache = ResponseCache(
+    MemoryCacheBackend(RESPONSE_CACHE_SIZE), ttl=RESPONSE_CACHE_TTL_SECONDS
+)
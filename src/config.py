@@ -0,0 +1,107 @@
+import os
+
+# settings are read from the environment so the same code runs locally and when deployed
+
+
+# bcrypt runs in a thread pool so it doesn't block the event loop
+# 0 workers hashes inline on the event loop like before
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+# how many hash/verify calls may wait for a worker before new ones get a 503
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "64"))
+
+# how many verified tokens get_current_user keeps resolved in memory
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+
+# likes_count is normally bumped with an atomic UPDATE inside the like request
+# with the buffer on, increments are collected in memory and written every few seconds
+# so a viral post takes one UPDATE per flush instead of one per like
+LIKE_COUNTER_BUFFER = os.getenv("LIKE_COUNTER_BUFFER", "false").lower() in ("1", "true", "yes")
+LIKE_COUNTER_FLUSH_SECONDS = float(os.getenv("LIKE_COUNTER_FLUSH_SECONDS", "2"))
+
+# posts are pushed into every follower's timeline when they are created
+# authors with more followers than this are skipped and read at feed time instead
+CELEBRITY_FOLLOWER_THRESHOLD = int(os.getenv("CELEBRITY_FOLLOWER_THRESHOLD", "10000"))
+# recent posts copied into the timeline when someone follows an author
+TIMELINE_BACKFILL = int(os.getenv("TIMELINE_BACKFILL", "20"))
+# usernames and emails in use are kept in a Bloom filter so a name that was never taken
+# is answered without a query, sized for this many entries (two per user) at this rate
+# of false positives, it is made bigger at startup when there are already more
+AVAILABILITY_FILTER = os.getenv("AVAILABILITY_FILTER", "true").lower() in ("1", "true", "yes")
+AVAILABILITY_FILTER_CAPACITY = int(os.getenv("AVAILABILITY_FILTER_CAPACITY", "1000000"))
+AVAILABILITY_FILTER_ERROR_RATE = float(os.getenv("AVAILABILITY_FILTER_ERROR_RATE", "0.01"))
+
+# users recounted per transaction by the profile stats repair job (python -m src.auth.stats)
+USER_STATS_REPAIR_BATCH_SIZE = int(os.getenv("USER_STATS_REPAIR_BATCH_SIZE", "1000"))
+# most post ids one "which of these did I like" lookup takes, a feed page or two
+LIKED_LOOKUP_MAX_IDS = int(os.getenv("LIKED_LOOKUP_MAX_IDS", "100"))
+
+# trending hashtags are counted in time buckets over a sliding window
+TRENDING_BUCKET_SECONDS = int(os.getenv("TRENDING_BUCKET_SECONDS", "300"))
+TRENDING_WINDOW_SECONDS = int(os.getenv("TRENDING_WINDOW_SECONDS", "86400"))
+# how often the top list served by the api is recomputed, and how long it is
+TRENDING_REFRESH_SECONDS = float(os.getenv("TRENDING_REFRESH_SECONDS", "30"))
+TRENDING_TOP_K = int(os.getenv("TRENDING_TOP_K", "100"))
+
+# hashtag suggestions, prefixes matching more tags than HASHTAG_SUGGEST_SCAN_LIMIT (the
+# one and two letter ones) keep their ranked result for HASHTAG_SUGGEST_CACHE_SECONDS
+HASHTAG_SUGGEST_SCAN_LIMIT = int(os.getenv("HASHTAG_SUGGEST_SCAN_LIMIT", "2000"))
+HASHTAG_SUGGEST_CACHE_SIZE = int(os.getenv("HASHTAG_SUGGEST_CACHE_SIZE", "1000"))
+HASHTAG_SUGGEST_CACHE_SECONDS = float(os.getenv("HASHTAG_SUGGEST_CACHE_SECONDS", "30"))
+
+# rendered responses of the read heavy post routes, dropped early when a write touches them
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+
+# NDJSON bulk import, posts per transaction and limits that keep memory flat
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", "500"))
+BULK_IMPORT_MAX_LINE_BYTES = int(os.getenv("BULK_IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+# only this many line errors are listed in the response, the rest are only counted
+BULK_IMPORT_MAX_ERRORS = int(os.getenv("BULK_IMPORT_MAX_ERRORS", "1000"))
+
+# posts fetched per round trip when a user's posts are exported as NDJSON
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+# requests slower than this get a sampled stack profile written to PROFILE_DIR
+# 0 turns the profiler off, it samples the event loop every PROFILE_INTERVAL_MS while on
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# sync url of the database, the api talks to it through the matching async driver
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./src/sql.db")
+# optional second database (e.g a postgres replica) the GET routes read from
+# left empty, reads share the primary's connection pool
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL", "")
+# connection pool per engine, sqlite files are pooled too so each connection keeps
+# its page cache and memory map between requests
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# applied to every new sqlite connection, WAL lets readers run while a write commits
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+# NORMAL is durable against crashes of the app in WAL mode, only a power loss can drop
+# the last commits
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# negative is KiB, so 64MB of page cache per connection
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-64000"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# like, post and follow events wait here for the activity worker, past the size a
+# request waits at most ACTIVITY_ENQUEUE_TIMEOUT_MS for room and then drops the event
+ACTIVITY_QUEUE_SIZE = int(os.getenv("ACTIVITY_QUEUE_SIZE", "10000"))
+ACTIVITY_ENQUEUE_TIMEOUT_MS = float(os.getenv("ACTIVITY_ENQUEUE_TIMEOUT_MS", "50"))
+# events written per transaction, and how long shutdown waits for the queue to empty
+ACTIVITY_BATCH_SIZE = int(os.getenv("ACTIVITY_BATCH_SIZE", "500"))
+ACTIVITY_DRAIN_SECONDS = float(os.getenv("ACTIVITY_DRAIN_SECONDS", "10"))
+
+# uploaded images, stored under their sha256 so the same file is only kept once
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+MEDIA_MAX_UPLOAD_BYTES = int(os.getenv("MEDIA_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# bytes per read and write while an upload is copied and hashed, and while a file is served
+MEDIA_CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", str(64 * 1024)))
+# thumbnails are made by this many worker processes (needs Pillow, 0 turns them off)
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# longest side of a thumbnail in pixels
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "320"))
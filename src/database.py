@@ -1,23 +1,154 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from .config import (
+    DATABASE_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    READ_DATABASE_URL,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_CACHE_SIZE,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_MMAP_SIZE,
+    SQLITE_SYNCHRONOUS,
+)
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+# the async driver used by the api for each sync url
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+
+SQLITE_PRAGMAS = {
+    "journal_mode": SQLITE_JOURNAL_MODE,
+    "synchronous": SQLITE_SYNCHRONOUS,
+    "mmap_size": SQLITE_MMAP_SIZE,
+    "cache_size": SQLITE_CACHE_SIZE,
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+}
+
+
+def async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+# PRAGMAs are per connection so they run every time the pool opens one
+# query_only makes the read engine refuse writes even though it is the same file
+def apply_sqlite_pragmas(engine, pragmas: dict, read_only: bool = False):
+    pragmas = {**pragmas, "query_only": "ON"} if read_only else pragmas
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    event.listen(engine, "connect", on_connect)
+
+
+def create_api_engine(url: str, pragmas: dict = SQLITE_PRAGMAS, read_only: bool = False):
+    url = async_url(url)
+    options = {"pool_pre_ping": True}
+    pooled = True
+    if url.get_backend_name() == "sqlite":
+        # aiosqlite defaults to a new connection per session, PRAGMAs and page cache
+        # included, a pool keeps them warm (in memory databases stay unpooled)
+        pooled = url.database not in (None, "", ":memory:")
+        if pooled:
+            options["poolclass"] = AsyncAdaptedQueuePool
+    if pooled:
+        options.update(
+            pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT
+        )
+    api_engine = create_async_engine(url, **options)
+    if api_engine.dialect.name == "sqlite":
+        apply_sqlite_pragmas(api_engine.sync_engine, pragmas, read_only)
+    return api_engine
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./src/sql.db"
 
+# sync engine is only used for creating the tables and for scripts
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
+    connect_args={"check_same_thread": False}
+    if make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "sqlite"
+    else {},
     pool_pre_ping=True,
 )
+if engine.dialect.name == "sqlite":
+    apply_sqlite_pragmas(engine, SQLITE_PRAGMAS)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_api_engine(SQLALCHEMY_DATABASE_URL)
+
+# expire_on_commit is off so objects can still be read after commit without
+# an implicit refresh, which async sessions can't do on attribute access
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
+# GET routes read through their own engine when READ_DATABASE_URL is set, with
+# sqlite it can point at the same file to give readers a pool of their own
+# a replica can lag the primary, a read right after a write may not see it yet
+read_engine = (
+    create_api_engine(READ_DATABASE_URL, read_only=True) if READ_DATABASE_URL else async_engine
+)
+AsyncReadSessionLocal = async_sessionmaker(
+    read_engine, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+# for routes that only read
+async def get_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+# INSERT that skips rows clashing with a unique constraint instead of raising
+# sqlite and postgres both spell it ON CONFLICT DO NOTHING
+def insert_or_ignore(db, table):
+    dialect = db.bind.dialect.name
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    # mysql / mariadb
+    return insert(table).prefix_with("IGNORE")
+
+
+# INSERT that adds to the counters of the row already there instead of raising,
+# key is the primary key column and columns the counters, the inserted values are the deltas
+def insert_or_add(db, table, key: str, *columns: str):
+    dialect = db.bind.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        statement = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={
+                column: table.c[column] + statement.excluded[column] for column in columns
+            },
+        )
+    # mysql / mariadb
+    statement = mysql.insert(table)
+    return statement.on_duplicate_key_update(
+        {column: table.c[column] + statement.inserted[column] for column in columns}
+    )
@@ -1,6 +1,47 @@
+from contextlib import AsyncExitStack, asynccontextmanager
+
 from fastapi import FastAPI 
-from .database import Base, engine
+from fastapi.responses import PlainTextResponse
+from .database import AsyncReadSessionLocal, Base, async_engine, engine, read_engine
 from .api import router
+from .activity.pipeline import activity_pipeline
+from .auth.availability import availability_filter
+from .auth.hashing import password_hasher
+from .auth.service import identity_cache
+from .cache import response_cache
+from .media.storage import media_store
+from .metrics import MetricsMiddleware, instrument_engine, render_metrics
+from .migrate import migrate
+from .post.counters import like_counter_buffer
+from .post.search import create_search_index
+from .post.suggest import hashtag_suggestions
+from .post.trending import trending_hashtags
+
+
+# the teardown is registered on an exit stack as each part starts, so every part is
+# still stopped when starting a later one or stopping another one raises
+# it runs backwards: the workers drain first and the engines they write through go last
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with AsyncExitStack() as stack:
+        # pooled aiosqlite connections each hold a worker thread that would keep the process alive
+        stack.push_async_callback(async_engine.dispose)
+        stack.push_async_callback(read_engine.dispose)
+        # the thumbnails being made finish before their worker processes go away
+        stack.callback(media_store.shutdown)
+        # and in flight logins before the worker threads
+        stack.callback(password_hasher.shutdown)
+        await trending_hashtags.rebuild(AsyncReadSessionLocal)
+        await hashtag_suggestions.rebuild(AsyncReadSessionLocal)
+        await availability_filter.rebuild(AsyncReadSessionLocal)
+        like_counter_buffer.start()
+        stack.push_async_callback(like_counter_buffer.stop)
+        # write out the queued activities before the database goes away
+        activity_pipeline.start()
+        stack.push_async_callback(activity_pipeline.stop)
+        trending_hashtags.start()
+        stack.push_async_callback(trending_hashtags.stop)
+        yield
 
 
 app = FastAPI(
@@ -8,9 +49,18 @@ app = FastAPI(
   description="Engine behind a social media",
   version="0.1.0",
   docs_url="/docs",
+  lifespan=lifespan,
   )
 
 Base.metadata.create_all(bind=engine)
+migrate(engine)
+create_search_index(engine)
+
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+if read_engine is not async_engine:
+    instrument_engine(read_engine.sync_engine)
 
 
 @app.get("/")
@@ -19,4 +69,19 @@ async def homepage():
         "details":"Homepage Success"
         }
 
-app.include_router(router)
\ No newline at end of file
+
+# prometheus text format, latency and SQL per route plus the stats of the caches and pools
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    return render_metrics({
+        "password_hash": password_hasher.stats(),
+        "identity_cache": identity_cache.stats(),
+        "response_cache": response_cache.backend.stats(),
+        "like_counter_buffer": like_counter_buffer.stats(),
+        "activity": activity_pipeline.stats(),
+        "media": media_store.stats(),
+        "hashtag_suggestions": hashtag_suggestions.stats(),
+        "availability": availability_filter.stats(),
+        })
+
+app.include_router(router)
@@ -0,0 +1,11 @@
+from typing import Optional, TypedDict
+
+
+class MediaUpload(TypedDict):
+    # sha256 of the file, uploading the same bytes again gives the same id
+    id: str
+    url: str
+    thumbnail_url: Optional[str]
+    content_type: str
+    size: int
+    created: bool
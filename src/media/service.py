@@ -0,0 +1,199 @@
+import os
+import re
+from typing import Optional
+
+import anyio
+from fastapi import HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+
+from .schemas import MediaUpload
+from .storage import SNIFF_BYTES, media_store, sniff_content_type
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart before 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# files never change under their hash so clients and proxies can keep them for good
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+# room for the boundaries and part headers around the file when the Content-Length
+# of an upload is checked against the limit before any of it is read
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+
+
+# the multipart body is parsed as it is received and the bytes of the file go straight
+# into the store, instead of the form parser spooling the whole body to a temporary file
+# first, so an upload over the limit is cut off there and every file is written once
+async def upload_media_svc(request: Request) -> MediaUpload:
+    content_length = request.headers.get("content-length")
+    if content_length and int(content_length) > media_store.max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Images can be at most {media_store.max_bytes} bytes",
+        )
+    stored = await media_store.save(_file_part(request))
+    has_thumbnail = await media_store.thumbnail(stored.sha256)
+    url = f"/v1/media/{stored.sha256}"
+    return {
+        "id": stored.sha256,
+        "url": url,
+        "thumbnail_url": f"{url}/thumbnail" if has_thumbnail else None,
+        "content_type": stored.content_type,
+        "size": stored.size,
+        "created": stored.created,
+    }
+
+
+# the data of the first part named field_name that is a file, in chunks of about
+# media_store.chunk_size as the body comes in
+async def _file_part(request: Request, field_name: str = "file"):
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Upload the image as multipart/form-data",
+        )
+    part = {"headers": {}, "field": b"", "value": b"", "file": False}
+    data = bytearray()
+    found = False
+
+    def on_part_begin():
+        part.update(headers={}, file=False)
+
+    def on_header_field(chunk: bytes, start: int, end: int):
+        part["field"] += chunk[start:end]
+
+    def on_header_value(chunk: bytes, start: int, end: int):
+        part["value"] += chunk[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part.update(field=b"", value=b"")
+
+    def on_headers_finished():
+        nonlocal found
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["file"] = (
+            not found
+            and disposition.get(b"name") == field_name.encode()
+            and b"filename" in disposition
+        )
+        found = found or part["file"]
+
+    def on_part_data(chunk: bytes, start: int, end: int):
+        if part["file"]:
+            data.extend(chunk[start:end])
+
+    parser = MultipartParser(
+        options[b"boundary"],
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+        },
+    )
+    async for chunk in request.stream():
+        parser.write(chunk)
+        if len(data) >= media_store.chunk_size:
+            yield bytes(data)
+            data.clear()
+    parser.finalize()
+    if not found:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"The image goes in the multipart field {field_name!r}",
+        )
+    if data:
+        yield bytes(data)
+
+
+# serves a stored file with its hash as a strong ETag and a single byte range when asked
+# (video players and resumed downloads), several ranges get the whole file instead
+async def media_response(
+    request: Request, path: str, etag: str, content_type: Optional[str] = None
+) -> Response:
+    described = await anyio.to_thread.run_sync(_describe, path)
+    if described is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media not found")
+    size, sniffed_type = described
+    etag = f'"{etag}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": CACHE_CONTROL}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    start, end = 0, size - 1
+    status_code = status.HTTP_200_OK
+    range_header = request.headers.get("range")
+    # If-Range asks for the range only if the file is still the one the client has
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is False:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{size}"},
+            )
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        _read_range(path, start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type=content_type or sniffed_type,
+    )
+
+
+def _describe(path: str):
+    try:
+        with open(path, "rb") as file:
+            head = file.read(SNIFF_BYTES)
+            return os.fstat(file.fileno()).st_size, sniff_content_type(head)
+    except FileNotFoundError:
+        return None
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+# (start, end) of the range, None to ignore the header and send everything,
+# False when the range lies outside the file
+def _parse_range(value: str, size: int):
+    match = RANGE_PATTERN.fullmatch(value.strip())
+    if match is None or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-n is the last n bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+async def _read_range(path: str, start: int, end: int):
+    remaining = end - start + 1
+    async with await anyio.open_file(path, "rb") as file:
+        await file.seek(start)
+        while remaining > 0:
+            chunk = await file.read(min(media_store.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
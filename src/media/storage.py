@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, NamedTuple, Optional
+
+from fastapi import HTTPException, status
+
+from ..config import (
+    MEDIA_CHUNK_SIZE,
+    MEDIA_DIR,
+    MEDIA_MAX_UPLOAD_BYTES,
+    THUMBNAIL_SIZE,
+    THUMBNAIL_WORKERS,
+)
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, without it uploads just get no thumbnail
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# the first bytes of every image format that is accepted
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+SNIFF_BYTES = 16
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return None
+
+
+class StoredFile(NamedTuple):
+    sha256: str
+    size: int
+    content_type: str
+    # False when the exact same file was already stored
+    created: bool
+
+
+# runs in a worker process, the result is written next to the target and renamed
+# so a half written thumbnail is never served
+def make_thumbnail(source: str, target: str, size: int):
+    with Image.open(source) as image:
+        # jpegs can be decoded straight at a fraction of their size
+        image.draft("RGB", (size, size))
+        image.thumbnail((size, size))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        partial = f"{target}.{os.getpid()}.tmp"
+        image.save(partial, "JPEG", quality=85)
+    os.replace(partial, target)
+
+
+# an upload on its way into the store, every chunk is counted, hashed and written to a
+# temporary file next to the originals, finish() renames that file to the hash or
+# drops it when the same file is stored already
+class PartialUpload:
+    def __init__(self, store: "MediaStore"):
+        self.max_bytes = store.max_bytes
+        self.original_path = store.original_path
+        partial_dir = os.path.join(store.root, "tmp")
+        os.makedirs(partial_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=partial_dir)
+        self._out = os.fdopen(fd, "wb")
+        self._digest = hashlib.sha256()
+        self._head = b""
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Images can be at most {self.max_bytes} bytes",
+            )
+        if len(self._head) < SNIFF_BYTES:
+            self._head += chunk[: SNIFF_BYTES - len(self._head)]
+            # anything that isn't an image is turned away after its first bytes
+            if len(self._head) >= SNIFF_BYTES:
+                _accepted_content_type(self._head)
+        self._digest.update(chunk)
+        self._out.write(chunk)
+
+    def finish(self) -> StoredFile:
+        self._out.close()
+        content_type = _accepted_content_type(self._head)
+        sha256 = self._digest.hexdigest()
+        target = self.original_path(sha256)
+        if os.path.exists(target):
+            os.unlink(self.path)
+            return StoredFile(sha256, self.size, content_type, False)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(self.path, target)
+        return StoredFile(sha256, self.size, content_type, True)
+
+    def discard(self):
+        self._out.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+# images are stored under the sha256 of their bytes, an upload of a file that is
+# already there only costs the hashing and leaves one copy on disk
+# writing and hashing run in a thread, resizing in a process pool since Pillow holds
+# the GIL for most of the work, neither ever runs on the event loop
+class MediaStore:
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int,
+        chunk_size: int,
+        thumbnail_workers: int,
+        thumbnail_size: int,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.thumbnail_workers = thumbnail_workers
+        self.thumbnail_size = thumbnail_size
+        self.thumbnails_enabled = Image is not None and thumbnail_workers > 0
+        self._executor = self._new_executor() if self.thumbnails_enabled else None
+        # thumbnails being made, concurrent uploads of one file wait on the same job
+        self._pending: dict[str, asyncio.Future] = {}
+        self.uploads = 0
+        self.deduplicated = 0
+        self.bytes_written = 0
+        self.thumbnails = 0
+        self.thumbnail_failures = 0
+
+    # spawned workers only import this module, forking would copy the pooled
+    # connections and threads of the api into every worker
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.thumbnail_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    # a worker that died (a bad image, the OOM killer) breaks the whole pool for good,
+    # the first job to notice swaps in a new one so later uploads get thumbnails again
+    def _replace_broken_executor(self, executor: ProcessPoolExecutor):
+        if self._executor is executor:
+            logger.warning("Thumbnail worker died, restarting the pool")
+            self._executor = self._new_executor()
+            executor.shutdown(wait=False)
+
+    def original_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "originals", sha256[:2], sha256)
+
+    def thumbnail_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "thumbnails", sha256[:2], f"{sha256}.jpg")
+
+    # the chunks are written as they come in, so nothing past max_bytes is ever received
+    # into memory or onto the disk, a failed upload leaves no file behind
+    async def save(self, chunks: AsyncIterator[bytes]) -> StoredFile:
+        upload = await asyncio.to_thread(PartialUpload, self)
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(upload.write, chunk)
+            stored = await asyncio.to_thread(upload.finish)
+        except BaseException:
+            upload.discard()
+            raise
+        self.uploads += 1
+        if stored.created:
+            self.bytes_written += stored.size
+        else:
+            self.deduplicated += 1
+        return stored
+
+    # makes the thumbnail of a stored image unless it is there already
+    # returns False when there is no thumbnail to serve
+    async def thumbnail(self, sha256: str) -> bool:
+        target = self.thumbnail_path(sha256)
+        if os.path.exists(target):
+            return True
+        if not self.thumbnails_enabled or not os.path.exists(self.original_path(sha256)):
+            return False
+        pending = self._pending.get(sha256)
+        if pending is None:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            executor = self._executor
+            try:
+                pending = asyncio.get_running_loop().run_in_executor(
+                    executor,
+                    make_thumbnail,
+                    self.original_path(sha256),
+                    target,
+                    self.thumbnail_size,
+                )
+            except BrokenProcessPool:
+                # the upload goes on without a thumbnail
+                self.thumbnail_failures += 1
+                self._replace_broken_executor(executor)
+                return False
+            self._pending[sha256] = pending
+            pending.add_done_callback(lambda future: self._finished(sha256, executor, future))
+        try:
+            # a client going away must not cancel the job the others wait on
+            await asyncio.shield(pending)
+        except Exception:
+            return False
+        return True
+
+    def _finished(self, sha256: str, executor: ProcessPoolExecutor, future: asyncio.Future):
+        self._pending.pop(sha256, None)
+        if future.cancelled() or future.exception() is not None:
+            self.thumbnail_failures += 1
+            if not future.cancelled():
+                logger.warning("Failed to make thumbnail of %s: %s", sha256, future.exception())
+                if isinstance(future.exception(), BrokenProcessPool):
+                    self._replace_broken_executor(executor)
+        else:
+            self.thumbnails += 1
+
+    def stats(self) -> dict:
+        return {
+            "thumbnail_workers": self.thumbnail_workers if self.thumbnails_enabled else 0,
+            "thumbnails_pending": len(self._pending),
+            "uploads": self.uploads,
+            "deduplicated": self.deduplicated,
+            "bytes_written": self.bytes_written,
+            "thumbnails": self.thumbnails,
+            "thumbnail_failures": self.thumbnail_failures,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+def _accepted_content_type(head: bytes) -> str:
+    content_type = sniff_content_type(head)
+    if content_type is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Only JPEG, PNG, GIF and WebP images can be uploaded",
+        )
+    return content_type
+
+
+media_store = MediaStore(
+    MEDIA_DIR, MEDIA_MAX_UPLOAD_BYTES, MEDIA_CHUNK_SIZE, THUMBNAIL_WORKERS, THUMBNAIL_SIZE
+)
@@ -0,0 +1,66 @@
+from fastapi import APIRouter, Depends, HTTPException, Path, Request, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth.service import get_current_user
+from ..database import get_read_db
+from .service import media_response, upload_media_svc
+from .storage import media_store
+
+router = APIRouter(prefix="/media", tags=["media"], default_response_class=ORJSONResponse)
+
+# ids are sha256 hex digests, nothing else can reach the file system
+MEDIA_ID_PATTERN = "^[0-9a-f]{64}$"
+
+
+# the body is read by upload_media_svc as it streams in, so the form is described here
+# for the docs instead of being parsed up front as an UploadFile parameter
+UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
+
+# upload an image as the multipart field "file", the url in the response goes into
+# the image of a post or the profile_pic of a user
+# the token is checked before any of the body is read
+@router.post("", status_code=status.HTTP_201_CREATED, openapi_extra=UPLOAD_BODY)
+async def upload_media(
+    request: Request, token: str, db: AsyncSession = Depends(get_read_db)
+):
+    await get_current_user(db, token)
+    # a slow upload shouldn't hold on to a pooled connection while it comes in
+    await db.close()
+    return ORJSONResponse(await upload_media_svc(request), status_code=status.HTTP_201_CREATED)
+
+
+@router.get("/{media_id}")
+async def get_media(request: Request, media_id: str = Path(pattern=MEDIA_ID_PATTERN)):
+    return await media_response(request, media_store.original_path(media_id), media_id)
+
+
+# made on first request for images stored before thumbnails were turned on
+@router.get("/{media_id}/thumbnail")
+async def get_media_thumbnail(
+    request: Request, media_id: str = Path(pattern=MEDIA_ID_PATTERN)
+):
+    if not await media_store.thumbnail(media_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Thumbnail not available"
+        )
+    return await media_response(
+        request,
+        media_store.thumbnail_path(media_id),
+        f"{media_id}-{media_store.thumbnail_size}",
+        "image/jpeg",
+    )
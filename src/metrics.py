@@ -0,0 +1,291 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from .config import PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_SLOW_REQUEST_MS
+
+# upper bounds in seconds, the last bucket (+Inf) is implicit
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+# cumulative histogram in the prometheus layout, one series per label tuple
+# only touched from the event loop so it needs no lock
+class Histogram:
+    def __init__(self, name: str, help: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            # one count per bucket plus +Inf, then sum
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            label_text = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = _labels(("le",), (str(bound),))
+                lines.append(f"{self.name}_bucket{_join(label_text, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_wrap(label_text)} {total}")
+            lines.append(f"{self.name}_count{_wrap(label_text)} {cumulative}")
+        return lines
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    return ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _wrap(label_text: str) -> str:
+    return f"{{{label_text}}}" if label_text else ""
+
+
+def _join(*parts: str) -> str:
+    return _wrap(",".join(part for part in parts if part))
+
+
+def _metric(name: str, kind: str, help: str, value) -> list[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+
+request_latency = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response",
+    ("method", "route", "status"),
+    LATENCY_BUCKETS,
+)
+request_sql_count = Histogram(
+    "http_request_sql_statements",
+    "SQL statements executed while serving one request",
+    ("method", "route"),
+    SQL_COUNT_BUCKETS,
+)
+request_sql_time = Histogram(
+    "http_request_sql_seconds",
+    "Time spent in SQL statements while serving one request",
+    ("method", "route"),
+    LATENCY_BUCKETS,
+)
+
+
+# [statements, seconds] of the request being served, engine events add to it
+# contextvars follow the request into sqlalchemy's greenlets so this works for async sessions
+_request_sql: ContextVar[list | None] = ContextVar("request_sql", default=None)
+sql_totals = {"statements": 0, "seconds": 0.0}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    sql_totals["statements"] += 1
+    sql_totals["seconds"] += elapsed
+    request_sql = _request_sql.get()
+    if request_sql is not None:
+        request_sql[0] += 1
+        request_sql[1] += elapsed
+
+
+# called once per engine, the async engine is instrumented through its sync_engine
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# samples the stack of the event loop thread while requests are in flight and writes
+# the samples of requests slower than the threshold in collapsed stack format
+# ("frame;frame;frame count" per line), which flamegraph.pl and speedscope read directly
+# the loop runs every request on one thread so a sample can show another request's
+# frames too, on a slow request it is usually the slow one that holds the loop
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms: float, interval_ms: float, directory: str):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._active: dict[int, Counter] = {}
+        self._thread_id = None
+        self._sampler = None
+        self.written = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def begin(self) -> Counter | None:
+        if not self.enabled:
+            return None
+        if self._sampler is None:
+            self._thread_id = threading.get_ident()
+            self._sampler = threading.Thread(
+                target=self._sample, name="slow-request-profiler", daemon=True
+            )
+            self._sampler.start()
+        samples = Counter()
+        with self._lock:
+            self._active[id(samples)] = samples
+        return samples
+
+    def end(self, samples: Counter | None, name: str, elapsed: float):
+        if samples is None:
+            return
+        with self._lock:
+            self._active.pop(id(samples), None)
+        if elapsed < self.threshold or not samples:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{_safe(name)}.folded"
+        with open(os.path.join(self.directory, file_name), "w") as file:
+            for stack, count in samples.items():
+                file.write(f"{stack} {count}\n")
+        self.written += 1
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frame = sys._current_frames().get(self._thread_id)
+                if frame is None:
+                    continue
+                stack = _collapse(frame)
+                for samples in self._active.values():
+                    samples[stack] += 1
+
+
+def _collapse(frame) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+def _safe(name: str) -> str:
+    return "".join(char if char.isalnum() else "_" for char in name).strip("_")
+
+
+profiler = SlowRequestProfiler(PROFILE_SLOW_REQUEST_MS, PROFILE_INTERVAL_MS, PROFILE_DIR)
+
+
+# plain asgi middleware, unlike @app.middleware("http") it sees the end of streamed
+# bodies and the request is timed up to its last byte, background tasks are left out
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        request_sql = [0, 0.0]
+        token = _request_sql.set(request_sql)
+        samples = profiler.begin()
+        status_code = 500
+        recorded = False
+
+        def record():
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            elapsed = time.perf_counter() - start
+            # the route template keeps the label count small, unmatched paths share one
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            request_latency.observe((method, path, str(status_code)), elapsed)
+            request_sql_count.observe((method, path), request_sql[0])
+            request_sql_time.observe((method, path), request_sql[1])
+            profiler.end(samples, f"{method} {path}", elapsed)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record()
+            _request_sql.reset(token)
+
+
+# keys of the components' stats() that only ever grow, exported as counters
+COUNTER_KEYS = {
+    "hits",
+    "misses",
+    "completed",
+    "rejected",
+    "busy_seconds",
+    "flushes",
+    "rows_written",
+    "published",
+    "dropped",
+    "failed",
+    "batches",
+    "written",
+    "uploads",
+    "deduplicated",
+    "bytes_written",
+    "thumbnails",
+    "thumbnail_failures",
+    "lookups",
+    "checks",
+    "skipped",
+    "false_positives",
+}
+
+
+# sources maps a metric prefix to a stats() dict, e.g {"identity_cache": {...}}
+def render_metrics(sources: dict) -> str:
+    lines = []
+    for histogram in (request_latency, request_sql_count, request_sql_time):
+        lines += histogram.render()
+    lines += _metric(
+        "sql_statements_total", "counter", "SQL statements executed", sql_totals["statements"]
+    )
+    lines += _metric(
+        "sql_seconds_total", "counter", "Time spent in SQL statements", sql_totals["seconds"]
+    )
+    lines += _metric(
+        "slow_request_profiles_total", "counter", "Profiles written for slow requests", profiler.written
+    )
+    for prefix, stats in sources.items():
+        for key, value in stats.items():
+            if not isinstance(value, (int, float)):
+                continue
+            if key in COUNTER_KEYS:
+                lines += _metric(f"{prefix}_{key}_total", "counter", f"{prefix} {key}", value)
+            else:
+                lines += _metric(f"{prefix}_{key}", "gauge", f"{prefix} {key}", float(value))
+    return "\n".join(lines) + "\n"
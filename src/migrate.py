@@ -0,0 +1,181 @@
+# Brings a database made by an earlier version of the models up to date
+#
+# create_all only creates the tables that are missing, it never adds a column or an
+# index to a table that is already there, so main.py runs migrate() right after it
+# every step looks at the schema first and does nothing when it is already there
+
+from sqlalchemy import delete, func, inspect, insert, select, text, update
+from sqlalchemy.schema import CreateColumn
+
+from .auth.models import User, UserStats, follows
+from .auth.stats import repair_statements
+from .database import Base
+from .post.models import Comment, Hashtag, Post, post_hashtags, post_likes
+
+
+def migrate(engine):
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        added = _add_missing_columns(connection, inspector)
+        if ("users", "followers_count") in added:
+            _backfill_follow_count(connection, "followers_count", follows.c.followee_id)
+        if ("users", "following_count") in added:
+            _backfill_follow_count(connection, "following_count", follows.c.follower_id)
+        if ("posts", "comments_count") in added:
+            _backfill_comments(connection)
+        migrate_post_likes = "ix_post_likes_post_id_user_id" not in _index_names(
+            inspector, "post_likes"
+        )
+        if migrate_post_likes:
+            _dedupe_rows(connection, post_likes)
+        if not _is_unique(inspector, "hashtags", "ix_hashtags_name"):
+            _merge_duplicate_hashtags(connection)
+        _create_missing_indexes(connection, inspector)
+        if migrate_post_likes:
+            _recount_likes(connection)
+        _backfill_user_stats(connection)
+
+
+def _index_names(inspector, table_name: str) -> set[str]:
+    return {index["name"] for index in inspector.get_indexes(table_name)}
+
+
+# False for an index that is missing or doesn't enforce uniqueness
+def _is_unique(inspector, table_name: str, index_name: str) -> bool:
+    if table_name not in inspector.get_table_names():
+        return False
+    return any(
+        index["name"] == index_name and index["unique"]
+        for index in inspector.get_indexes(table_name)
+    )
+
+
+# the tables of the models create_all found already there
+def _existing_tables(inspector):
+    names = set(inspector.get_table_names())
+    return [table for table in Base.metadata.sorted_tables if table.name in names]
+
+
+# columns the models gained since the table was made, every one of them has a server
+# default (or is nullable) so the rows already there get a value
+def _add_missing_columns(connection, inspector) -> set[tuple[str, str]]:
+    added = set()
+    preparer = connection.dialect.identifier_preparer
+    for table in _existing_tables(inspector):
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            definition = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.execute(
+                text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}")
+            )
+            added.add((table.name, column.name))
+    return added
+
+
+# a follow count of every user from the follows made before the column existed,
+# user_column is the side of the follow the user is on
+def _backfill_follow_count(connection, count_column: str, user_column):
+    connection.execute(
+        update(User).values(
+            {
+                count_column: select(func.count())
+                .select_from(follows)
+                .where(user_column == User.id)
+                .scalar_subquery()
+            }
+        )
+    )
+
+
+# the comments of every post that aren't deleted, as create and delete keep it
+def _backfill_comments(connection):
+    connection.execute(
+        update(Post).values(
+            comments_count=select(func.count())
+            .select_from(Comment)
+            .where(Comment.post_id == Post.id, Comment.deleted.is_(False))
+            .scalar_subquery()
+        )
+    )
+
+
+# post_likes had no key before likes were made idempotent, so liking twice stored the
+# pair twice, only one copy of each row is kept so the unique index can be built
+def _dedupe_rows(connection, table):
+    columns = list(table.columns)
+    rows = connection.execute(
+        select(*columns).group_by(*columns).having(func.count() > 1)
+    ).all()
+    for row in rows:
+        connection.execute(
+            delete(table).where(*(column == value for column, value in zip(columns, row)))
+        )
+    if rows:
+        connection.execute(insert(table), [row._asdict() for row in rows])
+
+
+# hashtags.name wasn't unique before tags were created with insert_or_ignore, so two
+# posts racing on a new tag could each add a row for it, the lowest id of a name is kept,
+# the posts of the others are moved onto it and the index is rebuilt as unique
+def _merge_duplicate_hashtags(connection):
+    kept_ids = (
+        select(Hashtag.name, func.min(Hashtag.id).label("id"))
+        .group_by(Hashtag.name)
+        .having(func.count() > 1)
+        .subquery()
+    )
+    duplicates = connection.execute(
+        select(Hashtag.id, kept_ids.c.id)
+        .join(kept_ids, kept_ids.c.name == Hashtag.name)
+        .where(Hashtag.id != kept_ids.c.id)
+    ).all()
+    for duplicate_id, kept_id in duplicates:
+        connection.execute(
+            update(post_hashtags)
+            .where(post_hashtags.c.hashtags_id == duplicate_id)
+            .values(hashtags_id=kept_id)
+        )
+    if duplicates:
+        # a post tagged with two copies of the name is now tagged twice with the kept one
+        _dedupe_rows(connection, post_hashtags)
+        connection.execute(
+            delete(Hashtag).where(Hashtag.id.in_([duplicate_id for duplicate_id, _ in duplicates]))
+        )
+    name_index = next(index for index in Hashtag.__table__.indexes if index.name == "ix_hashtags_name")
+    name_index.drop(connection, checkfirst=True)
+    name_index.create(connection)
+
+
+# every index of the models on the tables create_all found already there
+def _create_missing_indexes(connection, inspector):
+    for table in _existing_tables(inspector):
+        existing = _index_names(inspector, table.name)
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+
+
+# the duplicate likes were counted too, likes_count is recounted from the rows left
+def _recount_likes(connection):
+    connection.execute(
+        update(Post).values(
+            likes_count=select(func.count())
+            .select_from(post_likes)
+            .where(post_likes.c.post_id == Post.id)
+            .scalar_subquery()
+        )
+    )
+
+
+# user_stats is new to a database with posts made before it, every post and like adds
+# to it in the same transaction so it can only be empty while there are posts then
+def _backfill_user_stats(connection):
+    if connection.scalar(select(UserStats.user_id).limit(1)) is not None:
+        return
+    if connection.scalar(select(Post.id).limit(1)) is None:
+        return
+    first_id, last_id = connection.execute(select(func.min(User.id), func.max(User.id))).one()
+    for statement in repair_statements(first_id, last_id):
+        connection.execute(statement)
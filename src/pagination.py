@@ -0,0 +1,30 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+
+# cursors are opaque to the client, it only gets a string back that it has to send again
+# internally it is the sort key of the last row of the page e.g (created_dt, id)
+def encode_cursor(*keys) -> str:
+    values = [key.isoformat() if isinstance(key, datetime) else key for key in keys]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# turn the cursor back into the sort key, types says how each value should be parsed
+def decode_cursor(cursor: str, *types) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("cursor has the wrong shape")
+        return tuple(
+            datetime.fromisoformat(value) if key_type is datetime else key_type(value)
+            for key_type, value in zip(types, values)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
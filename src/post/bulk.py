@@ -0,0 +1,154 @@
+from datetime import datetime, timezone
+from typing import AsyncIterator
+
+import orjson
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth.stats import add_user_stats
+from ..cache import response_cache
+from ..config import (
+    BULK_IMPORT_CHUNK_SIZE,
+    BULK_IMPORT_MAX_ERRORS,
+    BULK_IMPORT_MAX_LINE_BYTES,
+)
+from .models import Post, post_hashtags
+from .schemas import BulkImportError, BulkImportResult, PostImport
+from .service import _get_or_create_hashtags, _hashtag_names
+from .timeline import fan_out_posts
+from .suggest import hashtag_suggestions
+from .trending import trending_hashtags
+
+
+# split a streamed body into lines without ever holding more than one line in memory
+# lines longer than max_line_bytes are dropped and come out as None
+async def _read_lines(
+    chunks: AsyncIterator[bytes], max_line_bytes: int
+) -> AsyncIterator[tuple[int, bytes | None]]:
+    buffer = bytearray()
+    line_number = 0
+    too_long = False
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            end = buffer.find(b"\n")
+            if end < 0:
+                break
+            line_number += 1
+            too_long = too_long or end > max_line_bytes
+            yield line_number, None if too_long else bytes(buffer[:end])
+            too_long = False
+            del buffer[: end + 1]
+        if len(buffer) > max_line_bytes:
+            too_long = True
+            buffer.clear()
+    if buffer.strip() or too_long:
+        yield line_number + 1, None if too_long else bytes(buffer)
+
+
+# import posts for one author from an NDJSON stream, one post object per line
+# valid lines are inserted chunk_size at a time with executemany, one transaction per
+# chunk, so a bad line only fails itself and a failed chunk doesn't undo earlier ones
+async def bulk_import_posts_svc(
+    db: AsyncSession,
+    author_id: int,
+    chunks: AsyncIterator[bytes],
+    chunk_size: int = BULK_IMPORT_CHUNK_SIZE,
+) -> BulkImportResult:
+    result = BulkImportResult(inserted=0, failed=0)
+
+    def add_error(line_number: int, error: str):
+        result.failed += 1
+        if len(result.errors) < BULK_IMPORT_MAX_ERRORS:
+            result.errors.append(BulkImportError(line=line_number, error=error))
+
+    chunk: list[tuple[int, PostImport]] = []
+    async for line_number, line in _read_lines(chunks, BULK_IMPORT_MAX_LINE_BYTES):
+        if line is None:
+            add_error(line_number, "Line is too long")
+            continue
+        if not line.strip():
+            continue
+        try:
+            chunk.append((line_number, PostImport.model_validate(orjson.loads(line))))
+        except (orjson.JSONDecodeError, ValidationError) as e:
+            add_error(line_number, str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            await _insert_chunk(db, author_id, chunk, result, add_error)
+            chunk = []
+    if chunk:
+        await _insert_chunk(db, author_id, chunk, result, add_error)
+    return result
+
+
+async def _insert_chunk(db: AsyncSession, author_id: int, chunk, result, add_error):
+    now = _as_utc(datetime.now(timezone.utc))
+    rows = [
+        {
+            "content": post.content,
+            "image": post.image,
+            "location": post.location,
+            "author_id": author_id,
+            # stored as naive utc like every other created_dt
+            "created_dt": _as_utc(post.created_dt) if post.created_dt else now,
+            "likes_count": 0,
+            "comments_count": 0,
+        }
+        for _, post in chunk
+    ]
+    tags_per_post = [_hashtag_names(row["content"]) for row in rows]
+    try:
+        # core insert on the table, the ORM bulk path adds nothing when no objects come back
+        # ids come back in the order of rows so they line up with tags_per_post
+        posts_table = Post.__table__
+        post_ids = (
+            await db.scalars(
+                insert(posts_table).returning(
+                    posts_table.c.id, sort_by_parameter_order=True
+                ),
+                rows,
+            )
+        ).all()
+        names = list(dict.fromkeys(name for tags in tags_per_post for name in tags))
+        if names:
+            hashtags = await _get_or_create_hashtags(db, names)
+            await db.execute(
+                insert(post_hashtags),
+                [
+                    {"post_id": post_id, "hashtags_id": hashtags[name].id}
+                    for post_id, tags in zip(post_ids, tags_per_post)
+                    for name in tags
+                ],
+            )
+        await fan_out_posts(db, author_id, post_ids)
+        await add_user_stats(db, author_id, posts_count=len(post_ids))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        for line_number, _ in chunk:
+            add_error(line_number, f"Failed to insert: {e}")
+        return
+    # the session would otherwise keep every hashtag it has seen
+    db.expunge_all()
+    result.inserted += len(post_ids)
+    for row, tags in zip(rows, tags_per_post):
+        if tags:
+            timestamp = row["created_dt"].replace(tzinfo=timezone.utc).timestamp()
+            trending_hashtags.record(tags, timestamp)
+            hashtag_suggestions.add(tags)
+    # a post older than now can land inside any cursor page of the feeds it is in
+    backdated = any(row["created_dt"] < now for row in rows)
+    await response_cache.invalidate(
+        "feed",
+        *(f"feed:{name}" for name in names),
+        *(f"hashtag:{name}" for name in names),
+        *(["feed_pages", *(f"feed_pages:{name}" for name in names)] if backdated else []),
+    )
+
+
+def _as_utc(created_dt: datetime) -> datetime:
+    if created_dt.tzinfo is not None:
+        created_dt = created_dt.astimezone(timezone.utc)
+    return created_dt.replace(tzinfo=None)
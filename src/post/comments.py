@@ -0,0 +1,198 @@
+from collections import defaultdict
+
+from fastapi import HTTPException, status
+from sqlalchemy import desc, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth.models import User
+from ..auth.schemas import CurrentUser
+from ..cache import response_cache
+from ..pagination import decode_cursor, encode_cursor
+from .models import Comment, Post
+from .schemas import CommentCreate, CommentPage, CommentRow, ThreadPage
+from .service import _ensure_post_exists
+
+# wide enough for any id, so paths compare as strings in id order
+PATH_SEGMENT = "{:010d}"
+
+COMMENT_COLUMNS = (
+    Comment.id,
+    Comment.parent_id,
+    Comment.depth,
+    Comment.content,
+    Comment.deleted,
+    Comment.replies_count,
+    Comment.created_dt,
+    User.username.label("author"),
+)
+
+
+def _comments_query(*extra_columns):
+    return select(*COMMENT_COLUMNS, *extra_columns).join(
+        User, User.id == Comment.author_id
+    )
+
+
+# the id is only known after the insert, so the path is filled in right after it
+# in the same transaction, the counters move with relative updates
+async def create_comment_svc(
+    db: AsyncSession, post_id: int, author: CurrentUser, request: CommentCreate
+) -> CommentRow:
+    await _ensure_post_exists(db, post_id)
+    parent = None
+    if request.parent_id is not None:
+        parent = await db.get(Comment, request.parent_id)
+        if parent is None or parent.post_id != post_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found"
+            )
+    comment = Comment(
+        post_id=post_id,
+        author_id=author.id,
+        parent_id=request.parent_id,
+        depth=parent.depth + 1 if parent else 0,
+        content=request.content,
+    )
+    db.add(comment)
+    await db.flush()
+    segment = PATH_SEGMENT.format(comment.id)
+    comment.root_id = parent.root_id if parent else comment.id
+    comment.path = f"{parent.path}/{segment}" if parent else segment
+    await db.execute(
+        update(Post)
+        .where(Post.id == post_id)
+        .values(comments_count=Post.comments_count + 1)
+    )
+    if parent:
+        await db.execute(
+            update(Comment)
+            .where(Comment.id == parent.id)
+            .values(replies_count=Comment.replies_count + 1)
+        )
+    await db.commit()
+    # the stored created_dt, naive utc like every read of the comment returns
+    await db.refresh(comment, ["created_dt"])
+    await response_cache.invalidate(f"post:{post_id}")
+    return {
+        "id": comment.id,
+        "parent_id": comment.parent_id,
+        "depth": comment.depth,
+        "content": comment.content,
+        "deleted": False,
+        "replies_count": 0,
+        "created_dt": comment.created_dt,
+        "author": author.username,
+    }
+
+
+# a page of top level comments, newest first with the id of the last one as cursor,
+# each with the first `replies` replies of its thread in path order
+# two queries whatever the page size: the top level range scan and one windowed scan
+# of the (root_id, path) index over the threads on the page
+async def get_comments_svc(
+    db: AsyncSession, post_id: int, limit: int = 20, cursor: str = None, replies: int = 3
+) -> CommentPage:
+    await _ensure_post_exists(db, post_id)
+    query = _comments_query().where(Comment.post_id == post_id, Comment.depth == 0)
+    if cursor:
+        (before,) = decode_cursor(cursor, int)
+        query = query.where(Comment.id < before)
+    rows = (await db.execute(query.order_by(desc(Comment.id)).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    comments = [{**row._asdict(), "replies": []} for row in rows]
+
+    root_ids = [comment["id"] for comment in comments if comment["replies_count"]]
+    if replies and root_ids:
+        position = func.row_number().over(
+            partition_by=Comment.root_id, order_by=Comment.path
+        )
+        ranked = (
+            _comments_query(Comment.root_id, Comment.path, position.label("position"))
+            .where(Comment.root_id.in_(root_ids), Comment.depth > 0)
+            .subquery()
+        )
+        reply_rows = await db.execute(
+            select(ranked)
+            .where(ranked.c.position <= replies)
+            .order_by(ranked.c.root_id, ranked.c.path)
+        )
+        replies_by_root = defaultdict(list)
+        for row in reply_rows:
+            reply = row._asdict()
+            root_id = reply.pop("root_id")
+            del reply["path"], reply["position"]
+            replies_by_root[root_id].append(reply)
+        for comment in comments:
+            comment["replies"] = replies_by_root[comment["id"]]
+    return {"comments": comments, "next_cursor": next_cursor}
+
+
+# every reply under a comment, at any depth, in path order with the last path as cursor
+# one range scan: the subtree of path p is everything between "p/" and "p0"
+# since "0" is the character right after "/"
+async def get_comment_thread_svc(
+    db: AsyncSession, comment_id: int, limit: int = 50, cursor: str = None
+) -> ThreadPage:
+    comment = await db.get(Comment, comment_id)
+    if comment is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found"
+        )
+    after = decode_cursor(cursor, str)[0] if cursor else f"{comment.path}/"
+    rows = (
+        await db.execute(
+            _comments_query(Comment.path)
+            .where(
+                Comment.root_id == comment.root_id,
+                Comment.path > after,
+                Comment.path < f"{comment.path}0",
+            )
+            .order_by(Comment.path)
+            .limit(limit + 1)
+        )
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].path)
+    comments = [row._asdict() for row in rows]
+    for row in comments:
+        del row["path"]
+    return {"comments": comments, "next_cursor": next_cursor}
+
+
+# only the author can delete a comment, one with replies is blanked instead of removed
+async def delete_comment_svc(db: AsyncSession, comment_id: int, user_id: int):
+    comment = await db.get(Comment, comment_id)
+    if comment is None or comment.deleted:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found"
+        )
+    if comment.author_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not authorized to delete this comment",
+        )
+    if comment.replies_count:
+        comment.deleted = True
+        comment.content = None
+    else:
+        await db.delete(comment)
+        if comment.parent_id is not None:
+            await db.execute(
+                update(Comment)
+                .where(Comment.id == comment.parent_id)
+                .values(replies_count=Comment.replies_count - 1)
+            )
+    await db.execute(
+        update(Post)
+        .where(Post.id == comment.post_id)
+        .values(comments_count=Post.comments_count - 1)
+    )
+    await db.commit()
+    await response_cache.invalidate(f"post:{comment.post_id}")
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+from sqlalchemy import bindparam, update
+
+from ..auth.stats import user_stats_table
+from ..cache import response_cache
+from ..config import LIKE_COUNTER_BUFFER, LIKE_COUNTER_FLUSH_SECONDS
+from ..database import AsyncSessionLocal, insert_or_add
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+posts_table = Post.__table__
+
+# one statement run with executemany, every row adds its own delta to its post
+_apply_deltas = (
+    update(posts_table)
+    .where(posts_table.c.id == bindparam("b_post_id"))
+    .values(likes_count=posts_table.c.likes_count + bindparam("b_delta"))
+)
+
+
+# write behind buffer for likes_count and the authors' likes_received
+# likes and unlikes on the same post add up in memory and get written as a single
+# relative UPDATE per post (and upsert per author) on every flush, the post_likes rows
+# themselves are still written in the request so only the counters lag behind by up
+# to one interval
+class LikeCounterBuffer:
+    def __init__(self, session_factory, interval: float, enabled: bool = True):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.enabled = enabled
+        self._pending: dict[int, int] = defaultdict(int)
+        self._authors: dict[int, int] = defaultdict(int)
+        self._task: asyncio.Task | None = None
+        self.flushes = 0
+        self.rows_written = 0
+
+    def add(self, post_id: int, author_id: int, delta: int):
+        self._pending[post_id] += delta
+        self._authors[author_id] += delta
+
+    async def flush(self):
+        pending, self._pending = self._pending, defaultdict(int)
+        authors, self._authors = self._authors, defaultdict(int)
+        params = [
+            {"b_post_id": post_id, "b_delta": delta}
+            for post_id, delta in pending.items()
+            if delta
+        ]
+        author_params = [
+            {"user_id": author_id, "likes_received": delta}
+            for author_id, delta in authors.items()
+            if delta
+        ]
+        if not params and not author_params:
+            return
+        try:
+            async with self.session_factory() as db:
+                if params:
+                    await db.execute(_apply_deltas, params)
+                if author_params:
+                    await db.execute(
+                        insert_or_add(db, user_stats_table, "user_id", "likes_received"),
+                        author_params,
+                    )
+                await db.commit()
+        except Exception:
+            # put the deltas back so the next flush retries them
+            for post_id, delta in pending.items():
+                self._pending[post_id] += delta
+            for author_id, delta in authors.items():
+                self._authors[author_id] += delta
+            raise
+        self.flushes += 1
+        self.rows_written += len(params)
+        # cached pages showing these posts now have a stale likes_count
+        await response_cache.invalidate(*(f"post:{post_id}" for post_id in pending))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush like counters")
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # whatever is left still has to reach the database
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending_posts": len(self._pending),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+
+like_counter_buffer = LikeCounterBuffer(
+    AsyncSessionLocal, LIKE_COUNTER_FLUSH_SECONDS, enabled=LIKE_COUNTER_BUFFER
+)
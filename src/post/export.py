@@ -0,0 +1,25 @@
+from typing import AsyncIterator
+
+import orjson
+
+from ..config import EXPORT_BATCH_SIZE
+from ..database import AsyncReadSessionLocal
+from .service import _to_show_post, _user_posts_query
+
+
+# every post of a user as NDJSON, one ShowPost object per line, newest first
+# rows come off a server side cursor batch_size at a time (hashtags and likers are
+# selectin loaded per batch) so memory is bounded by the batch and not by the account
+# the generator runs after the request's session is closed, so it opens its own
+async def export_user_posts_svc(
+    user_id: int, batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[bytes]:
+    async with AsyncReadSessionLocal() as db:
+        posts = await db.stream_scalars(
+            _user_posts_query(user_id).execution_options(yield_per=batch_size)
+        )
+        async for batch in posts.partitions():
+            yield b"".join(
+                orjson.dumps(_to_show_post(post), option=orjson.OPT_APPEND_NEWLINE)
+                for post in batch
+            )
@@ -6,6 +6,7 @@ from sqlalchemy import (
     Date,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     Table,
@@ -15,18 +16,37 @@ from sqlalchemy.orm import relationship
 from ..database import Base
 
 # Association Table for a many to many relationship with SQLalchemy
+# the first index loads the tags of a page of posts, the second lists the posts of a tag
 post_hashtags = Table(
     "post_hashtags",
     Base.metadata,
     Column("post_id", Integer, ForeignKey("posts.id")),
     Column("hashtags_id", Integer, ForeignKey("hashtags.id")),
+    Index("ix_post_hashtags_post_id_hashtags_id", "post_id", "hashtags_id"),
+    Index("ix_post_hashtags_hashtags_id_post_id", "hashtags_id", "post_id"),
 )
 
+# a user can like a post only once, the primary key makes liking twice a no-op
+# and answers "which of these posts did I like", the index lists the likers of a post
+# the index is unique too since tables made before the primary key only get the index
 post_likes = Table(
     "post_likes",
     Base.metadata,
-    Column("user_id", Integer, ForeignKey("users.id")),
-    Column("post_id", Integer, ForeignKey("posts.id")),
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("post_id", Integer, ForeignKey("posts.id"), primary_key=True),
+    Index("ix_post_likes_post_id_user_id", "post_id", "user_id", unique=True),
+)
+
+
+# materialized home timeline, one row per post per follower written when the post is made
+# reading a feed is a range scan on (user_id, created_dt, post_id)
+timeline = Table(
+    "timeline",
+    Base.metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("post_id", Integer, ForeignKey("posts.id"), primary_key=True),
+    Column("created_dt", DateTime, nullable=False),
+    Index("ix_timeline_user_id_created_dt_post_id", "user_id", "created_dt", "post_id"),
 )
 
 
@@ -37,8 +57,9 @@ class Post(Base):
     content = Column(String)
     image = Column(String)  # url of the image
     location = Column(String)
-    created_dt = Column(DateTime, default=datetime.now(timezone.utc))
+    created_dt = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     likes_count = Column(Integer, default=0)
+    comments_count = Column(Integer, default=0, nullable=False, server_default="0")
     author_id = Column(Integer, ForeignKey("users.id"))
     author = relationship("User", back_populates="posts")
 
@@ -46,12 +67,48 @@ class Post(Base):
 
     user_liked = relationship("User", secondary=post_likes, back_populates="liked_post")
 
+    # the feed is sorted by newest first, id breaks ties between posts made at the same time
+    # so that the (created_dt, id) cursor can seek straight to the next page
+    # the author index serves profile listings and fan-out-on-read for big accounts
+    __table_args__ = (
+        Index("ix_posts_created_dt_id", "created_dt", "id"),
+        Index("ix_posts_author_id_created_dt_id", "author_id", "created_dt", "id"),
+    )
+
+
+# comments and replies to them stored as a materialized path
+# path is the zero padded ids from the top level comment down to this one
+# ("0000000012/0000000040"), so sorting by path lists a thread depth first and the
+# replies under any comment are one range of (root_id, path)
+class Comment(Base):
+    __tablename__ = "comments"
+
+    id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
+    author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    parent_id = Column(Integer, ForeignKey("comments.id"))
+    # id of the top level comment of the thread, its own id for a top level comment
+    root_id = Column(Integer)
+    path = Column(String)
+    depth = Column(Integer, default=0, nullable=False)
+    content = Column(String)
+    # a deleted comment with replies stays as a placeholder so the thread holds together
+    deleted = Column(Boolean, default=False, nullable=False, server_default="0")
+    replies_count = Column(Integer, default=0, nullable=False, server_default="0")
+    created_dt = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    # top level comments of a post newest first, and a thread in path order
+    __table_args__ = (
+        Index("ix_comments_post_id_depth_id", "post_id", "depth", "id"),
+        Index("ix_comments_root_id_path", "root_id", "path"),
+    )
+
 
 class Hashtag(Base):
     __tablename__ = "hashtags"
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
+    name = Column(String, unique=True, index=True)
 
     posts = relationship("Post", secondary=post_hashtags, back_populates="hashtags")
 
@@ -1,21 +1,29 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, TypedDict
+
+from ..auth.schemas import FollowUser
 
 
 class PostCreate(BaseModel):
     content: Optional[str] = None
-    image: str
+    image: Optional[str] = None
     location: Optional[str] = None
 
     class Config:
         from_attributes = True
 
 
+# one line of a bulk import, created_dt keeps the original time of migrated posts
+class PostImport(PostCreate):
+    created_dt: Optional[datetime] = None
+
+
 class Post(PostCreate):
     id: int
     created_dt: datetime
     likes_count: int
+    comments_count: int
     author_id: int
 
     class Config:
@@ -31,14 +39,105 @@ class Hashtag(BaseModel):
 
 
 class ShowPost(BaseModel):
-    content: str
-    image: str
-    location: str
+    content: Optional[str] = None
+    image: Optional[str]
+    location: Optional[str] = None
     created_dt: datetime
     likes_count: int
+    comments_count: int
     author: str
     hashtags: Optional[List[str]] = []  # Assuming hashtags are a list
     user_liked: Optional[List[str]] = []
 
     class Config:
         from_attributes = True
+
+
+# plain dict rows built straight from the query columns for the listing routes,
+# they go to orjson as they are without a pydantic model in between
+class FeedPost(TypedDict):
+    id: int
+    content: Optional[str]
+    image: Optional[str]
+    location: Optional[str]
+    created_dt: datetime
+    likes_count: int
+    comments_count: int
+    author_id: int
+    username: str
+
+
+class PostRow(TypedDict):
+    id: int
+    content: Optional[str]
+    image: Optional[str]
+    location: Optional[str]
+    created_dt: datetime
+    likes_count: int
+    comments_count: int
+    author_id: int
+
+
+class ShowPostRow(TypedDict):
+    content: Optional[str]
+    image: Optional[str]
+    location: Optional[str]
+    created_dt: datetime
+    likes_count: int
+    comments_count: int
+    author: str
+    hashtags: List[str]
+    user_liked: List[str]
+
+
+class CommentCreate(BaseModel):
+    content: str = Field(min_length=1)
+    # the comment this one replies to, left out for a top level comment
+    parent_id: Optional[int] = None
+
+
+class CommentRow(TypedDict):
+    id: int
+    parent_id: Optional[int]
+    depth: int
+    content: Optional[str]
+    deleted: bool
+    replies_count: int
+    created_dt: datetime
+    author: str
+
+
+class TopLevelComment(CommentRow):
+    # the first replies of the thread in path order, depth tells how far to indent
+    replies: List[CommentRow]
+
+
+class CommentPage(TypedDict):
+    comments: List[TopLevelComment]
+    next_cursor: Optional[str]
+
+
+class ThreadPage(TypedDict):
+    comments: List[CommentRow]
+    next_cursor: Optional[str]
+
+
+class LikersPage(TypedDict):
+    users: List[FollowUser]
+    next_cursor: Optional[str]
+
+
+class LikedPosts(TypedDict):
+    # the asked ids the user has liked, in the order they were asked
+    liked: List[int]
+
+
+class BulkImportError(BaseModel):
+    line: int
+    error: str
+
+
+class BulkImportResult(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[BulkImportError] = []
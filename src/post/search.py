@@ -0,0 +1,121 @@
+import re
+
+from fastapi import HTTPException, status
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    and_,
+    literal_column,
+    or_,
+    select,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth.models import User
+from ..pagination import decode_cursor, encode_cursor
+from .models import Post
+from .service import POST_COLUMNS
+
+# full text index over posts.content and posts.location (sqlite FTS5)
+# it is an external content table, the text lives in posts only and the triggers
+# below keep the index in step with every insert, update and delete on posts
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+        content, location, content='posts', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_after_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, content, location)
+        VALUES (new.id, new.content, new.location);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_after_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, content, location)
+        VALUES ('delete', old.id, old.content, old.location);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_after_update AFTER UPDATE OF content, location ON posts
+    BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, content, location)
+        VALUES ('delete', old.id, old.content, old.location);
+        INSERT INTO posts_fts(rowid, content, location)
+        VALUES (new.id, new.content, new.location);
+    END
+    """,
+]
+
+# own metadata so create_all never tries to create it as a normal table
+posts_fts = Table(
+    "posts_fts",
+    MetaData(),
+    Column("rowid", Integer),
+    Column("content", String),
+    Column("location", String),
+)
+
+
+# create the index and triggers if they are missing, an index created on a database
+# that already has posts gets filled from them once
+def create_search_index(engine):
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'")
+        ).first()
+        for statement in SEARCH_INDEX_DDL:
+            connection.execute(text(statement))
+        if not exists:
+            connection.execute(text("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')"))
+
+
+# every word of the search is quoted so FTS5 syntax typed by users is matched literally
+def _match_expression(query: str) -> str:
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", query))
+
+
+# best matches first by BM25, the cursor is the (rank, id) of the last result
+# bm25() is lower for better matches so the order is ascending
+async def search_posts_svc(
+    db: AsyncSession, query: str, limit: int = 10, cursor: str = None
+):
+    if db.bind.dialect.name != "sqlite":
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Search is not available on this database",
+        )
+    match = _match_expression(query)
+    if not match:
+        return {"posts": [], "next_cursor": None}
+
+    rank = literal_column("bm25(posts_fts)")
+    search_query = (
+        select(*POST_COLUMNS, User.username, rank.label("rank"))
+        .select_from(posts_fts)
+        .join(Post, Post.id == posts_fts.c.rowid)
+        .join(User, Post.author_id == User.id)
+        .where(literal_column("posts_fts").op("MATCH")(match))
+    )
+    if cursor:
+        last_rank, last_id = decode_cursor(cursor, float, int)
+        search_query = search_query.where(
+            or_(rank > last_rank, and_(rank == last_rank, Post.id > last_id))
+        )
+    rows = (await db.execute(search_query.order_by(rank, Post.id).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].rank, rows[-1].id)
+    posts = [row._asdict() for row in rows]
+    for post in posts:
+        del post["rank"]
+    return {"posts": posts, "next_cursor": next_cursor}
@@ -1,23 +1,32 @@
 import re
+from datetime import datetime, timezone
 from typing import List, Optional
 
 from fastapi import Depends, FastAPI, HTTPException, status
-from sqlalchemy import desc
+from sqlalchemy import delete, desc, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.sql import func
 
+from ..activity.enums import ActivityType
+from ..activity.models import Activity
+from ..activity.pipeline import activity_pipeline
+from ..auth.stats import add_user_stats
 from ..auth.models import User
-from ..auth.schemas import User as UserSchema
-from .models import Hashtag, Post, post_hashtags
+from ..cache import response_cache
+from ..database import insert_or_ignore
+from ..pagination import decode_cursor, encode_cursor
+from .counters import like_counter_buffer
+from .models import Comment, Hashtag, Post, post_hashtags, post_likes, timeline
 from .schemas import Hashtag as HashtagSchema
-from .schemas import Post as PostSchema
-from .schemas import PostCreate, ShowPost
+from .schemas import FeedPost, LikedPosts, LikersPage, PostCreate, PostRow, ShowPostRow
+from .suggest import hashtag_suggestions
+from .trending import trending_hashtags
 
 
 # create the post service
-async def create_post_svc(request: PostCreate, db: Session, user_id: int):
+async def create_post_svc(request: PostCreate, db: AsyncSession, user_id: int):
 
     db_post = Post(
         content=request.content,
@@ -25,190 +34,344 @@ async def create_post_svc(request: PostCreate, db: Session, user_id: int):
         location=request.location,
         author_id=user_id,
     )
-    await create_hashtags_svc(db_post, db)
     db.add(db_post)
-    db.commit()
-    db.refresh(db_post)
+    hashtag_names = await create_hashtags_svc(db_post, db)
+    await add_user_stats(db, user_id, posts_count=1)
+    await db.commit()
+    await db.refresh(db_post)
+    # the in memory counters only see the tags once the post is committed
+    trending_hashtags.record(hashtag_names)
+    hashtag_suggestions.add(hashtag_names)
+    await response_cache.invalidate(
+        "feed",
+        *(f"feed:{name}" for name in hashtag_names),
+        *(f"hashtag:{name}" for name in hashtag_names),
+    )
+    await activity_pipeline.publish(ActivityType.POST, user_id, post_id=db_post.id)
     return db_post
 
 
 # from that post content find which one with hash and save it to the Post db
 # use regex to do that
-async def create_hashtags_svc(post: Post, db: Session):
-    pattern = re.compile(r"#\w+")
-    matches = pattern.findall(post.content)
-    for match in matches:
-        # removes the first # of the hashtag itself
-        tags = match[1:]
-        hashtag = db.query(Hashtag).filter(Hashtag.name == tags).first()
-        if not hashtag:
-            hashtag = Hashtag(name=tags)
-            db.add(hashtag)
-            try:
-                db.commit()
-                db.refresh(hashtag)
-            except Exception as e:
-                db.rollback()
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
-                )
-        post.hashtags.append(hashtag)
+# all the tags are looked up in one IN query and the new ones inserted in one statement,
+# nothing is committed here so the tags go in the same transaction as the post
+async def create_hashtags_svc(post: Post, db: AsyncSession) -> list[str]:
+    names = _hashtag_names(post.content)
+    if not names:
+        return names
+    hashtags = await _get_or_create_hashtags(db, names)
+    post.hashtags.extend(hashtags[name] for name in names)
+    return names
+
+
+HASHTAG_PATTERN = re.compile(r"#\w+")
+
+
+def _hashtag_names(content: Optional[str]) -> list[str]:
+    # removes the first # of the hashtag itself, dict keeps the order and drops repeats
+    return list(dict.fromkeys(match[1:] for match in HASHTAG_PATTERN.findall(content or "")))
+
+
+async def _get_or_create_hashtags(
+    db: AsyncSession, names: list[str]
+) -> dict[str, Hashtag]:
+    result = await db.scalars(select(Hashtag).where(Hashtag.name.in_(names)))
+    hashtags = {hashtag.name: hashtag for hashtag in result}
+    missing = [name for name in names if name not in hashtags]
+    if missing:
+        # another request may insert the same tag in the meantime, the unique
+        # constraint on the name makes that a no-op instead of an error
+        try:
+            await db.execute(
+                insert_or_ignore(db, Hashtag),
+                [{"name": name} for name in missing],
+            )
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
+            )
+        result = await db.scalars(select(Hashtag).where(Hashtag.name.in_(missing)))
+        hashtags.update((hashtag.name, hashtag) for hashtag in result)
+    return hashtags
 
 
 # get users posts i.e all the posts related to a particular user
-async def get_user_post_svc(user_id: int, db: Session):
-    posts = (
-        db.query(Post)
-        .filter(Post.author_id == user_id)
-        .order_by(desc(Post.created_dt))
-        .all()
-    )
-    return [
-        ShowPost(
-            content=post.content,
-            image=post.image,
-            location=post.location,
-            created_dt=post.created_dt,
-            likes_count=post.likes_count,
-            author=post.author.username,  # Transform the User object to a string (username)
-            hashtags=post.hashtags,
-            user_liked=post.user_liked,
+async def get_user_post_svc(user_id: int, db: AsyncSession) -> list[ShowPostRow]:
+    posts = await db.scalars(_user_posts_query(user_id))
+    return [_to_show_post(post) for post in posts]
+
+
+# author, hashtags and likers are loaded up front with one extra query each for the whole list
+# instead of a lazy load per post every time a row gets built
+def _user_posts_query(user_id: int):
+    return (
+        select(Post)
+        .options(
+            joinedload(Post.author).load_only(User.username),
+            selectinload(Post.hashtags),
+            selectinload(Post.user_liked).load_only(User.username),
         )
-        for post in posts
-    ]
+        .where(Post.author_id == user_id)
+        .order_by(desc(Post.created_dt), desc(Post.id))
+    )
+
+
+def _to_show_post(post: Post) -> ShowPostRow:
+    return {
+        "content": post.content,
+        "image": post.image,
+        "location": post.location,
+        "created_dt": post.created_dt,
+        "likes_count": post.likes_count,
+        "comments_count": post.comments_count,
+        "author": post.author.username,  # Transform the User object to a string (username)
+        "hashtags": [hashtag.name for hashtag in post.hashtags],
+        "user_liked": [user.username for user in post.user_liked],
+    }
 
 
 # get posts from hashtags
-# The optional for the list[posts schema] means it can either return an instance of that schema to validate it or None
+# The optional for the list[posts rows] means it can either return the rows or None when the hashtag doesn't exist
+# the posts of the tag come in post id order straight from ix_post_hashtags_hashtags_id_post_id,
+# ordering by posts.id instead would sort them all again
 async def get_hashtag_posts_svc(
-    hash_tag_name: str, db: Session
-) -> Optional[List[PostSchema]]:
-    hash_tag = db.query(Hashtag).filter(Hashtag.name == hash_tag_name).first()
-    if not hash_tag:
+    hash_tag_name: str, db: AsyncSession
+) -> Optional[List[PostRow]]:
+    hash_tag_id = await db.scalar(select(Hashtag.id).where(Hashtag.name == hash_tag_name))
+    if hash_tag_id is None:
         return None
-    else:
-        return [PostSchema.model_validate(post) for post in hash_tag.posts]
+    rows = await db.execute(
+        select(*POST_COLUMNS)
+        .join(post_hashtags, post_hashtags.c.post_id == Post.id)
+        .where(post_hashtags.c.hashtags_id == hash_tag_id)
+        .order_by(post_hashtags.c.post_id)
+    )
+    return [row._asdict() for row in rows]
 
 
 # getting random posts for the feed part
 # Use pagination to divide large set of data into smaller manageable parts/pages
+# N.B legacy page based version, every call counts the whole table and skips over offset rows
+# so deep pages get slower as the posts grow, use get_feed_posts_svc with a cursor instead
 async def get_random_posts_svc(
-    db: Session, page: int = 1, limit: int = 10, hashtag: str = None
+    db: AsyncSession, page: int = 1, limit: int = 10, hashtag: str = None
 ):
     # query for total posts count
-    count_query = db.query(func.count(Post.id))
+    count_query = select(func.count(Post.id))
     if hashtag:
         # filter count of posts with hashtag
-        count_query = count_query.join(Post.hashtags).filter(Hashtag.name == hashtag)
+        count_query = count_query.join(Post.hashtags).where(Hashtag.name == hashtag)
     # give result of the total posts based on hashtags or no hashtags scalar used for single value
-    total_posts = count_query.scalar()
+    total_posts = await db.scalar(count_query)
 
     # calc offset
     offset = (page - 1) * limit
     if offset >= total_posts:
         return []
 
-    # Base query to fetch the posts
-    posts_query = (
-        db.query(Post, User.username).join(User).order_by(desc(Post.created_dt))
+    # fetch the post with pagination now
+    posts = await db.execute(_feed_query(hashtag).offset(offset).limit(limit))
+    return _format_feed_posts(posts)
+
+
+# keyset (cursor) pagination of the feed
+# the cursor is the (created_dt, id) of the last post on the previous page so the next page
+# is a seek on ix_posts_created_dt_id, no count query and no offset rows to skip
+# the row value comparison is what makes it a seek, spelled out as created_dt < x OR
+# (created_dt = x AND id < y) the planner scans the index from the top instead
+async def get_feed_posts_svc(
+    db: AsyncSession, limit: int = 10, hashtag: str = None, cursor: str = None
+):
+    posts_query = _feed_query(hashtag)
+    if cursor:
+        created_dt, post_id = decode_cursor(cursor, datetime, int)
+        posts_query = posts_query.where(
+            tuple_(Post.created_dt, Post.id) < tuple_(created_dt, post_id)
+        )
+    # fetch one extra row to know if there is a next page at all
+    posts = (await db.execute(posts_query.limit(limit + 1))).all()
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        last_post = posts[-1]
+        next_cursor = encode_cursor(last_post.created_dt, last_post.id)
+    return {"posts": _format_feed_posts(posts), "next_cursor": next_cursor}
+
+
+# columns the listings select instead of whole Post objects
+POST_COLUMNS = (
+    Post.id,
+    Post.content,
+    Post.image,
+    Post.location,
+    Post.created_dt,
+    Post.likes_count,
+    Post.comments_count,
+    Post.author_id,
+)
+
+
+# Base query to fetch the posts, newest first
+def _feed_query(hashtag: str = None):
+    posts_query = select(*POST_COLUMNS, User.username).join(
+        User, Post.author_id == User.id
     )
     if hashtag:
-        posts_query.join(Post.hashtags).filter(Hashtag.name == hashtag)
+        posts_query = posts_query.join(Post.hashtags).where(Hashtag.name == hashtag)
+    return posts_query.order_by(desc(Post.created_dt), desc(Post.id))
 
-    # fetch the post with pagination now
-    posts = posts_query.offset(offset).limit(limit).all()
 
-    results = []
-    # format how the results look like
-    for post, username in posts:
-        post_dict = post.__dict__.copy()
-        # copy makes it avoid modifying the original data instead just creates new copy
-        # modifies that one and data doesn't have issues
-        post_dict["username"] = username
-        results.append(post_dict)
-    return results
+# format how the results look like, every row already has exactly the feed columns
+def _format_feed_posts(posts) -> list[FeedPost]:
+    return [post._asdict() for post in posts]
 
 
 # get post from post_id
-async def get_post_from_id_svc(db: Session, user_id: int) -> Post:
-    posts = (
-        db.query(Post)
-        .filter(Post.author_id == user_id)
-        .order_by(desc(Post.created_dt))
-        .all()
-    )
-    return [
-        ShowPost(
-            content=post.content,
-            image=post.image,
-            location=post.location,
-            created_dt=post.created_dt,
-            likes_count=post.likes_count,
-            author=post.author.username,  # Transform the User object to a string (username)
-            hashtags=post.hashtags,
-            user_liked=post.user_liked,
-        )
-        for post in posts
-    ]
+async def get_post_from_id_svc(db: AsyncSession, user_id: int) -> list[ShowPostRow]:
+    posts = await db.scalars(_user_posts_query(user_id))
+    return [_to_show_post(post) for post in posts]
 
 
-async def delete_post_svc(db: Session, post_id: int) -> Post:
-    posts = await get_post_from_id_svc(db, post_id)
-    if posts:
-        db.delete(posts)
-        db.commit()
-    else:
-        raise HTTPException(status_code=404, detail="Post not found")
+# a single post by its id with its likers loaded
+async def get_post_svc(db: AsyncSession, post_id: int) -> Optional[Post]:
+    return await db.get(Post, post_id, options=[selectinload(Post.user_liked)])
 
 
-async def like_post_svc(db: AsyncSession, post_id: int, username: str):
-    post = await get_post_from_id_svc(db, post_id)
-    if not post:
+# the tags of the post are taken back out of trending and the suggestion counts
+async def delete_post_svc(db: AsyncSession, post_id: int) -> Post:
+    post = await get_post_svc(db, post_id)
+    if post:
+        hashtag_names = (
+            await db.scalars(
+                select(Hashtag.name)
+                .join(post_hashtags, post_hashtags.c.hashtags_id == Hashtag.id)
+                .where(post_hashtags.c.post_id == post_id)
+            )
+        ).all()
+        created_dt = post.created_dt
+        await db.execute(delete(timeline).where(timeline.c.post_id == post_id))
+        await db.execute(delete(Comment).where(Comment.post_id == post_id))
+        await db.execute(delete(Activity).where(Activity.post_id == post_id))
+        await add_user_stats(
+            db, post.author_id, posts_count=-1, likes_received=-len(post.user_liked)
+        )
+        await db.delete(post)
+        await db.commit()
+        # stored without a timezone but always written in utc
+        trending_hashtags.remove(hashtag_names, created_dt.replace(tzinfo=timezone.utc).timestamp())
+        hashtag_suggestions.remove(hashtag_names)
+        await response_cache.invalidate(
+            f"post:{post_id}",
+            "feed",
+            *(f"feed:{name}" for name in hashtag_names),
+            *(f"hashtag:{name}" for name in hashtag_names),
+        )
+    else:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    user = await db.execute(select(User).where(User.username == username))
-    user = user.scalars.first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    if user in post.user_liked:
-        raise HTTPException(status_code=400, detail="User already liked this post")
-    # append the user to the liked_post list of the post
-    post.user_liked.append(user)
-    post.likes_count = len(post.user_liked)
-    # TODO logic of the activity of like
+
+# liking and unliking are idempotent, the row in post_likes is inserted or deleted
+# in one statement and likes_count only moves when that statement changed a row
+async def like_post_svc(db: AsyncSession, post_id: int, user_id: int) -> bool:
+    author_id = await _ensure_post_exists(db, post_id)
     try:
+        result = await db.execute(
+            insert_or_ignore(db, post_likes).values(user_id=user_id, post_id=post_id)
+        )
+        liked = result.rowcount > 0
+        if liked:
+            await _change_likes_count(db, post_id, author_id, 1)
         await db.commit()
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to like post {e}")
+    if liked and like_counter_buffer.enabled:
+        like_counter_buffer.add(post_id, author_id, 1)
+    elif liked:
+        await response_cache.invalidate(f"post:{post_id}")
+    # the author hears about it from the activity worker, not from this request
+    if liked:
+        await activity_pipeline.publish(ActivityType.LIKE, user_id, post_id=post_id)
+    return liked
 
 
-async def unlike_post_svc(db: AsyncSession, post_id: int, username: str):
-    post = await get_post_from_id_svc(db, post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-    user = await db.execute(select(User).where(User.username == username))
-    user = user.scalars().first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    if user not in post.user_liked:
-        raise HTTPException(status_code=404, detail="Post wasn't liked")
-    post.user_liked.remove(user)
-    post.likes_count -= 1
+async def unlike_post_svc(db: AsyncSession, post_id: int, user_id: int) -> bool:
+    author_id = await _ensure_post_exists(db, post_id)
     try:
+        result = await db.execute(
+            delete(post_likes).where(
+                post_likes.c.user_id == user_id, post_likes.c.post_id == post_id
+            )
+        )
+        unliked = result.rowcount > 0
+        if unliked:
+            await _change_likes_count(db, post_id, author_id, -1)
         await db.commit()
     except Exception as e:
         await db.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to like post {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to unlike post {e}")
+    if unliked and like_counter_buffer.enabled:
+        like_counter_buffer.add(post_id, author_id, -1)
+    elif unliked:
+        await response_cache.invalidate(f"post:{post_id}")
+    return unliked
 
-    # users who liked the post
 
-
-async def liked_users_post_svc(db: AsyncSession, post_id: int) -> list[UserSchema]:
-    # get the post first
-    post = await get_post_from_id_svc(db, post_id)
-    if not post:
+# returns the author of the post
+async def _ensure_post_exists(db: AsyncSession, post_id: int) -> int:
+    row = (await db.execute(select(Post.author_id).where(Post.id == post_id))).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Post not found")
-    users_liked = post.user_liked
-    # have to turn the user_liked posts to a pydantic schema
-    return [UserSchema.model_validate(user) for user in users_liked]
+    return row.author_id
+
+
+# relative updates of the post's likes_count and its author's likes_received so
+# concurrent likes can't overwrite each other's count
+# with the write behind buffer on the buffer applies them after the commit instead
+async def _change_likes_count(db: AsyncSession, post_id: int, author_id: int, delta: int):
+    if like_counter_buffer.enabled:
+        return
+    await db.execute(
+        update(Post)
+        .where(Post.id == post_id)
+        .values(likes_count=Post.likes_count + delta)
+    )
+    await add_user_stats(db, author_id, likes_received=delta)
+
+
+# users who liked the post, a page at a time in user id order with the last id as cursor
+# only the public columns are selected, the page is a range scan on ix_post_likes_post_id_user_id
+async def liked_users_post_svc(
+    db: AsyncSession, post_id: int, limit: int = 20, cursor: str = None
+) -> LikersPage:
+    await _ensure_post_exists(db, post_id)
+    query = (
+        select(User.id, User.username, User.name, User.profile_pic)
+        .join(post_likes, post_likes.c.user_id == User.id)
+        .where(post_likes.c.post_id == post_id)
+    )
+    if cursor:
+        (after,) = decode_cursor(cursor, int)
+        query = query.where(post_likes.c.user_id > after)
+    rows = (await db.execute(query.order_by(post_likes.c.user_id).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    return {"users": [row._asdict() for row in rows], "next_cursor": next_cursor}
+
+
+# which of the posts the user has liked, one primary key search for the whole feed page
+async def get_liked_posts_svc(
+    db: AsyncSession, user_id: int, post_ids: list[int]
+) -> LikedPosts:
+    liked = set(
+        await db.scalars(
+            select(post_likes.c.post_id).where(
+                post_likes.c.user_id == user_id, post_likes.c.post_id.in_(post_ids)
+            )
+        )
+    )
+    return {"liked": [post_id for post_id in dict.fromkeys(post_ids) if post_id in liked]}
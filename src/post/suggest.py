@@ -0,0 +1,125 @@
+import heapq
+import time
+from array import array
+from bisect import bisect_left
+from typing import Iterable
+
+from sqlalchemy import func, select
+
+from ..cache import LRUCache
+from ..config import (
+    HASHTAG_SUGGEST_CACHE_SECONDS,
+    HASHTAG_SUGGEST_CACHE_SIZE,
+    HASHTAG_SUGGEST_SCAN_LIMIT,
+)
+from .models import Hashtag, post_hashtags
+
+# sorts after any character a hashtag can hold, key + this bounds every name under key
+PREFIX_END = "\U0010ffff"
+
+
+# every hashtag name in one list sorted case insensitively, with the number of posts
+# using it at the same position in an array of 4 byte counts
+# a prefix is two bisects for the range of names that start with it and the
+# suggestions are the top of that range by post count
+# see benchmarks/bench_suggest.py for the memory it takes per million tags
+class HashtagSuggestions:
+    def __init__(self, scan_limit: int, cache_size: int, cache_seconds: float):
+        self.scan_limit = scan_limit
+        self.cache_seconds = cache_seconds
+        self._names: list[str] = []
+        self._counts = array("I")
+        # ranked results of the prefixes that match too many tags to rank every time
+        self._cache = LRUCache(cache_size)
+        self.lookups = 0
+
+    def __len__(self):
+        return len(self._names)
+
+    # position of the name and whether it is there, or where it would go
+    def _find(self, name: str) -> tuple[int, bool]:
+        key = name.lower()
+        index = bisect_left(self._names, key, key=str.lower)
+        # names that only differ in case sit next to each other
+        while index < len(self._names) and self._names[index].lower() == key:
+            if self._names[index] == name:
+                return index, True
+            index += 1
+        return index, False
+
+    # one more post for each of the names, new names are put in their place
+    def add(self, names: Iterable[str]):
+        for name in names:
+            index, found = self._find(name)
+            if found:
+                self._counts[index] += 1
+            else:
+                self._names.insert(index, name)
+                self._counts.insert(index, 1)
+
+    # one post less for each of the names, a name stays with a count of 0 like the
+    # unused tags a rebuild loads
+    def remove(self, names: Iterable[str]):
+        for name in names:
+            index, found = self._find(name)
+            if found and self._counts[index] > 0:
+                self._counts[index] -= 1
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        self.lookups += 1
+        key = prefix.lower()
+        low = bisect_left(self._names, key, key=str.lower)
+        high = bisect_left(self._names, key + PREFIX_END, low, key=str.lower)
+        if high - low <= self.scan_limit:
+            return self._top(low, high, limit)
+        top = self._cache.get((key, limit))
+        if top is None:
+            top = self._top(low, high, limit)
+            self._cache.set((key, limit), top, time.time() + self.cache_seconds)
+        return top
+
+    def _top(self, low: int, high: int, limit: int) -> list[dict]:
+        counts = self._counts
+        best = heapq.nlargest(limit, range(low, high), key=counts.__getitem__)
+        return [{"name": self._names[index], "count": counts[index]} for index in best]
+
+    # every tag with the number of posts using it, counted per tag before the join
+    # so post_hashtags is read once
+    async def rebuild(self, session_factory):
+        uses = (
+            select(post_hashtags.c.hashtags_id, func.count().label("count"))
+            .group_by(post_hashtags.c.hashtags_id)
+            .subquery()
+        )
+        async with session_factory() as db:
+            rows = (
+                await db.execute(
+                    select(Hashtag.name, func.coalesce(uses.c.count, 0))
+                    .outerjoin(uses, uses.c.hashtags_id == Hashtag.id)
+                    .where(Hashtag.name.is_not(None))
+                )
+            ).all()
+        self.load(rows)
+
+    # replaces the whole index with (name, post count) pairs in any order
+    def load(self, rows: list[tuple[str, int]]):
+        rows = sorted(rows, key=lambda row: row[0].lower())
+        self._names = [name for name, _ in rows]
+        self._counts = array("I", (count for _, count in rows))
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        cache = self._cache.stats()
+        return {
+            "tags": len(self._names),
+            "lookups": self.lookups,
+            "hits": cache["hits"],
+            "misses": cache["misses"],
+        }
+
+
+hashtag_suggestions = HashtagSuggestions(
+    HASHTAG_SUGGEST_SCAN_LIMIT,
+    HASHTAG_SUGGEST_CACHE_SIZE,
+    HASHTAG_SUGGEST_CACHE_SECONDS,
+)
@@ -0,0 +1,146 @@
+from datetime import datetime
+
+from sqlalchemy import delete, desc, literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth.models import User, follows
+from ..config import CELEBRITY_FOLLOWER_THRESHOLD, TIMELINE_BACKFILL
+from ..database import AsyncSessionLocal, insert_or_ignore
+from ..pagination import decode_cursor, encode_cursor
+from .models import Post, timeline
+from .service import _feed_query, _format_feed_posts
+
+
+# fan-out-on-write, runs as a background task after the post is committed
+async def fan_out_post_svc(post_id: int, author_id: int):
+    async with AsyncSessionLocal() as db:
+        await fan_out_posts(db, author_id, [post_id])
+        await db.commit()
+
+
+# one INSERT ... SELECT copies the posts into the timeline of every follower,
+# authors above the celebrity threshold are skipped and merged in at read time
+# doesn't commit, the caller decides the transaction
+async def fan_out_posts(db: AsyncSession, author_id: int, post_ids: list[int]):
+    columns = ["user_id", "post_id", "created_dt"]
+    # authors see their own posts in their feed too
+    await db.execute(
+        insert_or_ignore(db, timeline).from_select(
+            columns,
+            select(literal(author_id), Post.id, Post.created_dt).where(
+                Post.id.in_(post_ids)
+            ),
+        )
+    )
+    followers_count = await db.scalar(
+        select(User.followers_count).where(User.id == author_id)
+    )
+    if (followers_count or 0) <= CELEBRITY_FOLLOWER_THRESHOLD:
+        await db.execute(
+            insert_or_ignore(db, timeline).from_select(
+                columns,
+                select(follows.c.follower_id, Post.id, Post.created_dt)
+                .join(Post, Post.author_id == follows.c.followee_id)
+                .where(follows.c.followee_id == author_id, Post.id.in_(post_ids)),
+            )
+        )
+
+
+# after a follow, copy the author's latest posts so the feed isn't empty until they post again
+async def backfill_timeline_svc(user_id: int, author_id: int):
+    async with AsyncSessionLocal() as db:
+        followers_count = await db.scalar(
+            select(User.followers_count).where(User.id == author_id)
+        )
+        if (followers_count or 0) > CELEBRITY_FOLLOWER_THRESHOLD:
+            return
+        recent_posts = (
+            select(literal(user_id), Post.id, Post.created_dt)
+            .where(Post.author_id == author_id)
+            .order_by(desc(Post.created_dt), desc(Post.id))
+            .limit(TIMELINE_BACKFILL)
+        )
+        await db.execute(
+            insert_or_ignore(db, timeline).from_select(
+                ["user_id", "post_id", "created_dt"], recent_posts
+            )
+        )
+        await db.commit()
+
+
+# after an unfollow, drop the author's posts from the timeline
+async def remove_from_timeline_svc(user_id: int, author_id: int):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(timeline).where(
+                timeline.c.user_id == user_id,
+                timeline.c.post_id.in_(
+                    select(Post.id).where(Post.author_id == author_id)
+                ),
+            )
+        )
+        await db.commit()
+
+
+# home feed of a user, newest first with a (created_dt, post_id) cursor
+# the materialized rows come from one range scan of the timeline, posts of followed
+# celebrities are read from their author index and merged in
+async def get_timeline_svc(
+    db: AsyncSession, user_id: int, limit: int = 10, cursor: str = None
+):
+    after = decode_cursor(cursor, datetime, int) if cursor else None
+
+    entries_query = select(timeline.c.created_dt, timeline.c.post_id).where(
+        timeline.c.user_id == user_id
+    )
+    if after:
+        entries_query = entries_query.where(
+            _before(timeline.c.created_dt, timeline.c.post_id, *after)
+        )
+    entries_query = entries_query.order_by(
+        desc(timeline.c.created_dt), desc(timeline.c.post_id)
+    ).limit(limit + 1)
+    entries = {
+        post_id: created_dt for created_dt, post_id in await db.execute(entries_query)
+    }
+
+    celebrity_ids = (
+        await db.scalars(
+            select(follows.c.followee_id)
+            .join(User, User.id == follows.c.followee_id)
+            .where(
+                follows.c.follower_id == user_id,
+                User.followers_count > CELEBRITY_FOLLOWER_THRESHOLD,
+            )
+        )
+    ).all()
+    if celebrity_ids:
+        celebrity_query = select(Post.created_dt, Post.id).where(
+            Post.author_id.in_(celebrity_ids)
+        )
+        if after:
+            celebrity_query = celebrity_query.where(
+                _before(Post.created_dt, Post.id, *after)
+            )
+        celebrity_query = celebrity_query.order_by(
+            desc(Post.created_dt), desc(Post.id)
+        ).limit(limit + 1)
+        # an author who crossed the threshold can have posts on both sides
+        for created_dt, post_id in await db.execute(celebrity_query):
+            entries[post_id] = created_dt
+
+    page = sorted(entries.items(), key=lambda entry: (entry[1], entry[0]), reverse=True)
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1][1], page[-1][0])
+
+    post_ids = [post_id for post_id, _ in page]
+    posts = await db.execute(_feed_query().where(Post.id.in_(post_ids)))
+    return {"posts": _format_feed_posts(posts), "next_cursor": next_cursor}
+
+
+# a row value comparison so the cursor bounds the index range, spelled out with OR the
+# planner only seeks on user_id and filters the rest of the timeline row by row
+def _before(created_column, id_column, created_dt: datetime, row_id: int):
+    return tuple_(created_column, id_column) < tuple_(created_dt, row_id)
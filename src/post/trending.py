@@ -0,0 +1,136 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from ..config import (
+    TRENDING_BUCKET_SECONDS,
+    TRENDING_REFRESH_SECONDS,
+    TRENDING_TOP_K,
+    TRENDING_WINDOW_SECONDS,
+)
+from .models import Hashtag, Post, post_hashtags
+
+logger = logging.getLogger(__name__)
+
+
+# hashtag uses over a sliding window, counted per time bucket
+# totals over the whole window are kept up to date as uses come in and buckets fall out,
+# so a refresh only has to pick the top K out of the totals
+class TrendingHashtags:
+    def __init__(
+        self,
+        bucket_seconds: int,
+        window_seconds: int,
+        top_k: int,
+        refresh_seconds: float,
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.buckets_in_window = max(window_seconds // bucket_seconds, 1)
+        self.top_k = top_k
+        self.refresh_seconds = refresh_seconds
+        self._buckets: dict[int, Counter] = {}
+        self._totals: Counter = Counter()
+        self._top: list[dict] = []
+        self._task: asyncio.Task | None = None
+
+    # timestamp is unix seconds, defaults to now
+    def record(self, names, timestamp: float = None):
+        bucket = int((timestamp or time.time()) // self.bucket_seconds)
+        if bucket <= self._current_bucket() - self.buckets_in_window:
+            return
+        counts = self._buckets.setdefault(bucket, Counter())
+        for name in names:
+            counts[name] += 1
+            self._totals[name] += 1
+
+    # takes back uses recorded before, e.g of a post that was deleted
+    # uses whose bucket already fell out of the window are gone anyway
+    def remove(self, names, timestamp: float = None):
+        bucket = int((timestamp or time.time()) // self.bucket_seconds)
+        counts = self._buckets.get(bucket)
+        if counts is None:
+            return
+        for name in names:
+            if counts[name] > 0:
+                counts[name] -= 1
+                self._totals[name] -= 1
+
+    def _current_bucket(self) -> int:
+        return int(time.time() // self.bucket_seconds)
+
+    def _expire(self):
+        oldest = self._current_bucket() - self.buckets_in_window + 1
+        for bucket in [bucket for bucket in self._buckets if bucket < oldest]:
+            self._totals.subtract(self._buckets.pop(bucket))
+        # drop tags that went back to zero so totals doesn't grow forever
+        for name in [name for name, count in self._totals.items() if count <= 0]:
+            del self._totals[name]
+
+    def refresh(self):
+        self._expire()
+        self._top = [
+            {"name": name, "count": count}
+            for name, count in heapq.nlargest(
+                self.top_k, self._totals.items(), key=lambda item: item[1]
+            )
+        ]
+
+    def top(self, limit: int = 10) -> list[dict]:
+        return self._top[:limit]
+
+    # start from what is already in the database, every post_hashtags row of a post
+    # made inside the window counts as one use at the time of the post
+    async def rebuild(self, session_factory):
+        since = datetime.now(timezone.utc) - timedelta(
+            seconds=self.buckets_in_window * self.bucket_seconds
+        )
+        self._buckets.clear()
+        self._totals.clear()
+        async with session_factory() as db:
+            uses = await db.stream(
+                select(Hashtag.name, Post.created_dt)
+                .select_from(post_hashtags)
+                .join(Hashtag, Hashtag.id == post_hashtags.c.hashtags_id)
+                .join(Post, Post.id == post_hashtags.c.post_id)
+                .where(Post.created_dt >= since.replace(tzinfo=None))
+                .execution_options(yield_per=1000)
+            )
+            async for name, created_dt in uses:
+                # stored without a timezone but always written in utc
+                timestamp = created_dt.replace(tzinfo=timezone.utc).timestamp()
+                self.record([name], timestamp)
+        self.refresh()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh trending hashtags")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+trending_hashtags = TrendingHashtags(
+    TRENDING_BUCKET_SECONDS,
+    TRENDING_WINDOW_SECONDS,
+    TRENDING_TOP_K,
+    TRENDING_REFRESH_SECONDS,
+)
@@ -1,34 +1,67 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
-from ..database import get_db
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    HTTPException,
+    Depends,
+    Query,
+    Request,
+    status,
+)
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..cache import response_cache
+from ..config import BULK_IMPORT_CHUNK_SIZE, LIKED_LOOKUP_MAX_IDS
+from ..database import get_db, get_read_db
 from typing import List
 
 
-from .schemas import PostCreate, Post as PostSchema, ShowPost
+from .schemas import BulkImportResult, CommentCreate, PostCreate, Post as PostSchema, ShowPost
+from .bulk import bulk_import_posts_svc
+from .comments import (
+    create_comment_svc,
+    delete_comment_svc,
+    get_comment_thread_svc,
+    get_comments_svc,
+)
+from .export import export_user_posts_svc
 from .service import (
     create_post_svc,
     create_hashtags_svc,
     get_user_post_svc,
     get_hashtag_posts_svc,
     get_random_posts_svc,
+    get_feed_posts_svc,
     get_post_from_id_svc,
     delete_post_svc,
     like_post_svc,
     unlike_post_svc,
     liked_users_post_svc,
+    get_liked_posts_svc,
 )
+from .search import search_posts_svc
+from .timeline import fan_out_post_svc, get_timeline_svc
+from .suggest import hashtag_suggestions
+from .trending import trending_hashtags
 from ..auth.service import (
     get_current_user,
     get_current_user_from_user_id,
     existing_user,
 )
 
-router = APIRouter(prefix="/posts", tags=["posts"])
+# orjson renders the responses, listing routes hand it their rows directly
+router = APIRouter(
+    prefix="/posts", tags=["posts"], default_response_class=ORJSONResponse
+)
 
 
 # create posts by a user
 @router.post("/", response_model=PostSchema, status_code=status.HTTP_201_CREATED)
-async def create_post(request: PostCreate, token: str, db: Session = Depends(get_db)):
+async def create_post(
+    request: PostCreate,
+    token: str,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+):
     # verify the token  to be sure
     user = await get_current_user(db, token)
     if not user.id:
@@ -38,26 +71,43 @@ async def create_post(request: PostCreate, token: str, db: Session = Depends(get
         )
     # create posts now
     post = await create_post_svc(request, db, user.id)
+    # push the post to the followers' timelines after the response has gone out
+    background_tasks.add_task(fan_out_post_svc, post.id, user.id)
     return post
 
 
+# import many posts at once from an NDJSON body, one post object per line
+# the body is read as it streams in so its size doesn't matter
+@router.post(
+    "/bulk", response_model=BulkImportResult, status_code=status.HTTP_201_CREATED
+)
+async def bulk_import_posts(
+    request: Request,
+    token: str,
+    chunk_size: int = Query(BULK_IMPORT_CHUNK_SIZE, ge=1, le=10000),
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_current_user(db, token)
+    return await bulk_import_posts_svc(db, user.id, request.stream(), chunk_size)
+
+
 # get posts of current user
 @router.get("/", response_model=List[ShowPost], status_code=status.HTTP_200_OK)
-async def get_current_posts_from_user(token: str, db: Session = Depends(get_db)):
+async def get_current_posts_from_user(token: str, db: AsyncSession = Depends(get_read_db)):
     user = await get_current_user(db, token)
     if not user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User does not exist",
         )
-    return await get_user_post_svc(user.id, db)
+    return ORJSONResponse(await get_user_post_svc(user.id, db))
 
 
 # get posts of any users N.B!! with their username
 @router.get(
     "/user/{username}", response_model=List[ShowPost], status_code=status.HTTP_200_OK
 )
-async def get_user_post(username: str, db: Session = Depends(get_db)):
+async def get_user_post(username: str, db: AsyncSession = Depends(get_read_db)):
     user = await existing_user(db, username=username)
     # user id
     if not user:
@@ -65,16 +115,190 @@ async def get_user_post(username: str, db: Session = Depends(get_db)):
             status_code=status.HTTP_404_NOT_FOUND, detail="User does not exist"
         )
     posts = await get_post_from_id_svc(db, user.id)
-    return posts
+    return ORJSONResponse(posts)
+
+
+# every post of a user as NDJSON, streamed out in batches instead of built as one list
+@router.get("/user/{username}/export", status_code=status.HTTP_200_OK)
+async def export_user_posts(username: str, db: AsyncSession = Depends(get_read_db)):
+    user = await existing_user(db, username=username)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User does not exist"
+        )
+    return StreamingResponse(
+        export_user_posts_svc(user.id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{username}-posts.ndjson"'},
+    )
 
 
+# most used hashtags over the trending window, served from memory
+@router.get("/hashtags/trending", status_code=status.HTTP_200_OK)
+async def get_trending_hashtags(limit: int = Query(10, ge=1, le=100)):
+    return trending_hashtags.top(limit)
+
+
+# hashtags starting with prefix (any case, with or without the #) by how many posts use them
+@router.get("/hashtags/suggest", status_code=status.HTTP_200_OK)
+async def suggest_hashtags(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+):
+    return hashtag_suggestions.suggest(prefix.removeprefix("#"), limit)
+
+
+# served from the response cache, see _post_tags for what drops a cached page
 @router.get("/hashtag/{hashtag}")
-async def get_posts_from_hashtags(hashtag: str, db: Session = Depends(get_db)):
-    return await get_hashtag_posts_svc(hashtag, db)
+async def get_posts_from_hashtags(hashtag: str, db: AsyncSession = Depends(get_read_db)):
+    return await response_cache.get_or_render(
+        response_cache.key("hashtag", hashtag=hashtag),
+        lambda: get_hashtag_posts_svc(hashtag, db),
+        lambda posts: [f"hashtag:{hashtag}", *_post_tags(posts or [])],
+    )
+
 
+# home feed, posts of the people the user follows and their own
+@router.get("/feed", status_code=status.HTTP_200_OK)
+async def get_home_feed(
+    token: str,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: str = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    user = await get_current_user(db, token)
+    return ORJSONResponse(await get_timeline_svc(db, user.id, limit, cursor))
 
+
+# full text search over the content and location of posts
+@router.get("/search", status_code=status.HTTP_200_OK)
+async def search_posts(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=100),
+    cursor: str = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    return ORJSONResponse(await search_posts_svc(db, q, limit, cursor))
+
+
+# pass the next_cursor of a page back as cursor to get the page after it
+# page is still accepted for older clients and returns the plain list of posts
 @router.get("/feed/posts")
 async def get_random_posts(
-    page: int = 1, limit: int = 5, hashtag: str = None, db: Session = Depends(get_db)
+    page: int = None,
+    limit: int = Query(5, ge=1, le=100),
+    hashtag: str = None,
+    cursor: str = None,
+    db: AsyncSession = Depends(get_read_db),
 ):
-    return await get_random_posts_svc(db, page, limit, hashtag)
+    key = response_cache.key(
+        "feed", page=page, limit=limit, hashtag=hashtag, cursor=cursor
+    )
+    if page is not None:
+        return await response_cache.get_or_render(
+            key,
+            lambda: get_random_posts_svc(db, page, limit, hashtag),
+            lambda posts: [_feed_tag(hashtag), *_post_tags(posts)],
+        )
+    # a cursor page only holds posts older than the cursor so a new post never changes it,
+    # only the first page has to go when something is posted, the later ones go when
+    # posts are imported with a created_dt in the past
+    return await response_cache.get_or_render(
+        key,
+        lambda: get_feed_posts_svc(db, limit, hashtag, cursor),
+        lambda page: [
+            _feed_pages_tag(hashtag) if cursor else _feed_tag(hashtag),
+            *_post_tags(page["posts"]),
+        ],
+    )
+
+
+# a cached page is dropped when any post on it changes (liked, deleted)
+def _post_tags(posts: list[dict]) -> list[str]:
+    return [f"post:{post['id']}" for post in posts]
+
+
+# and the first pages when a new post comes in
+def _feed_tag(hashtag: str = None) -> str:
+    return f"feed:{hashtag}" if hashtag else "feed"
+
+
+# and the pages after them when older posts are imported
+def _feed_pages_tag(hashtag: str = None) -> str:
+    return f"feed_pages:{hashtag}" if hashtag else "feed_pages"
+
+
+# like a post, liking it again changes nothing
+@router.post("/{post_id}/like", status_code=status.HTTP_204_NO_CONTENT)
+async def like_post(post_id: int, token: str, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(db, token)
+    await like_post_svc(db, post_id, user.id)
+
+
+@router.delete("/{post_id}/like", status_code=status.HTTP_204_NO_CONTENT)
+async def unlike_post(post_id: int, token: str, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(db, token)
+    await unlike_post_svc(db, post_id, user.id)
+
+
+# pass the next_cursor of a page back as cursor to get the page after it
+@router.get("/{post_id}/likes", status_code=status.HTTP_200_OK)
+async def get_post_likers(
+    post_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    return ORJSONResponse(await liked_users_post_svc(db, post_id, limit, cursor))
+
+
+# which posts of a feed page the user has liked, e.g ?ids=3&ids=5&ids=8
+@router.get("/liked", status_code=status.HTTP_200_OK)
+async def get_liked_posts(
+    token: str,
+    ids: List[int] = Query(..., min_length=1, max_length=LIKED_LOOKUP_MAX_IDS),
+    db: AsyncSession = Depends(get_read_db),
+):
+    user = await get_current_user(db, token)
+    return ORJSONResponse(await get_liked_posts_svc(db, user.id, ids))
+
+
+# comment on a post, parent_id makes it a reply to another comment on the same post
+@router.post("/{post_id}/comments", status_code=status.HTTP_201_CREATED)
+async def create_comment(
+    post_id: int, request: CommentCreate, token: str, db: AsyncSession = Depends(get_db)
+):
+    user = await get_current_user(db, token)
+    return ORJSONResponse(
+        await create_comment_svc(db, post_id, user, request),
+        status_code=status.HTTP_201_CREATED,
+    )
+
+
+# newest top level comments first, each with the first few replies of its thread
+@router.get("/{post_id}/comments", status_code=status.HTTP_200_OK)
+async def get_comments(
+    post_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str = None,
+    replies: int = Query(3, ge=0, le=20),
+    db: AsyncSession = Depends(get_read_db),
+):
+    return ORJSONResponse(await get_comments_svc(db, post_id, limit, cursor, replies))
+
+
+# all the replies under a comment at any depth, in thread order
+@router.get("/comments/{comment_id}/thread", status_code=status.HTTP_200_OK)
+async def get_comment_thread(
+    comment_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    return ORJSONResponse(await get_comment_thread_svc(db, comment_id, limit, cursor))
+
+
+@router.delete("/comments/{comment_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_comment(comment_id: int, token: str, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(db, token)
+    await delete_comment_svc(db, comment_id, user.id)
@@ -0,0 +1,76 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, insert, inspect, select
+from sqlalchemy.exc import IntegrityError
+
+from src.database import Base
+from src.migrate import migrate
+from src.post.models import Hashtag, post_hashtags
+
+# the database shipped with the repo, made by the models before this series
+BASELINE_DB = Path(__file__).resolve().parent.parent / "src" / "sql.db"
+
+
+@pytest.fixture
+def engine(tmp_path):
+    path = tmp_path / "baseline.db"
+    shutil.copy(BASELINE_DB, path)
+    engine = create_engine(f"sqlite:///{path}")
+    yield engine
+    engine.dispose()
+
+
+# the same startup main.py runs
+def start(engine):
+    Base.metadata.create_all(bind=engine)
+    migrate(engine)
+
+
+def name_index(engine) -> dict:
+    indexes = inspect(engine).get_indexes("hashtags")
+    return next(index for index in indexes if index["name"] == "ix_hashtags_name")
+
+
+def test_duplicate_hashtags_are_merged_and_the_name_made_unique(engine):
+    assert not name_index(engine)["unique"]
+    # two posts raced on "dup", post 1 got both copies, post 2 only the second
+    with engine.begin() as connection:
+        connection.execute(
+            insert(Hashtag), [{"id": 1, "name": "dup"}, {"id": 2, "name": "dup"}, {"id": 3, "name": "other"}]
+        )
+        connection.execute(
+            insert(post_hashtags),
+            [
+                {"post_id": 1, "hashtags_id": 1},
+                {"post_id": 1, "hashtags_id": 2},
+                {"post_id": 2, "hashtags_id": 2},
+                {"post_id": 2, "hashtags_id": 3},
+            ],
+        )
+
+    start(engine)
+
+    assert name_index(engine)["unique"]
+    with engine.connect() as connection:
+        assert connection.execute(select(Hashtag.id, Hashtag.name).order_by(Hashtag.id)).all() == [
+            (1, "dup"),
+            (3, "other"),
+        ]
+        assert sorted(connection.execute(select(post_hashtags)).all()) == [(1, 1), (2, 1), (2, 3)]
+    with pytest.raises(IntegrityError), engine.begin() as connection:
+        connection.execute(insert(Hashtag).values(name="dup"))
+
+
+def test_a_migrated_database_is_left_as_it_is(engine):
+    start(engine)
+    with engine.connect() as connection:
+        before = connection.execute(select(Hashtag.id, Hashtag.name)).all()
+    indexes = {table: inspect(engine).get_indexes(table) for table in inspect(engine).get_table_names()}
+
+    start(engine)
+
+    with engine.connect() as connection:
+        assert connection.execute(select(Hashtag.id, Hashtag.name)).all() == before
+    assert {table: inspect(engine).get_indexes(table) for table in inspect(engine).get_table_names()} == indexes
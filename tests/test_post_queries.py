@@ -0,0 +1,106 @@
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.auth.models import User
+from src.database import Base
+from src.post.models import Hashtag, Post, post_hashtags, post_likes
+from src.post.service import get_feed_posts_svc, get_post_from_id_svc, get_user_post_svc
+
+AUTHOR_ID = 1
+LIKERS = 3
+TAGS = 2
+
+
+# an author with `posts` posts, every post tagged and liked by a few other users
+async def seed(session_factory, posts: int):
+    async with session_factory() as db:
+        await db.execute(
+            insert(User),
+            [
+                {
+                    "id": user_id,
+                    "email": f"user{user_id}@example.com",
+                    "username": f"user{user_id}",
+                    "name": f"user{user_id}",
+                    "password": "x",
+                    "dob": date(1990, 1, 1),
+                }
+                for user_id in range(1, LIKERS + 2)
+            ],
+        )
+        await db.execute(
+            insert(Hashtag), [{"id": tag_id, "name": f"tag{tag_id}"} for tag_id in range(1, TAGS + 1)]
+        )
+        await db.execute(
+            insert(Post),
+            [
+                {"id": post_id, "content": f"post {post_id}", "author_id": AUTHOR_ID}
+                for post_id in range(1, posts + 1)
+            ],
+        )
+        await db.execute(
+            insert(post_hashtags),
+            [
+                {"post_id": post_id, "hashtags_id": tag_id}
+                for post_id in range(1, posts + 1)
+                for tag_id in range(1, TAGS + 1)
+            ],
+        )
+        await db.execute(
+            insert(post_likes),
+            [
+                {"post_id": post_id, "user_id": user_id}
+                for post_id in range(1, posts + 1)
+                for user_id in range(2, LIKERS + 2)
+            ],
+        )
+        await db.commit()
+
+
+# statements a service runs against a database holding `posts` posts
+async def count_statements(tmp_path, posts: int, service) -> int:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / f'{posts}.db'}")
+    statements = []
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        await seed(session_factory, posts)
+
+        event.listen(
+            engine.sync_engine,
+            "before_cursor_execute",
+            lambda connection, cursor, statement, *args: statements.append(statement),
+        )
+        async with session_factory() as db:
+            rows = await service(db)
+        assert len(rows) == posts
+    finally:
+        await engine.dispose()
+    return len(statements)
+
+
+@pytest.mark.parametrize(
+    "service",
+    [
+        lambda db: get_user_post_svc(AUTHOR_ID, db),
+        lambda db: get_post_from_id_svc(db, AUTHOR_ID),
+    ],
+    ids=["get_user_post_svc", "get_post_from_id_svc"],
+)
+def test_user_posts_take_a_constant_number_of_queries(tmp_path, service):
+    one = asyncio.run(count_statements(tmp_path, 1, service))
+    many = asyncio.run(count_statements(tmp_path, 50, service))
+    # the posts, then the hashtags and the likers of all of them at once
+    assert one == many == 3
+
+
+def test_feed_page_is_one_query(tmp_path):
+    async def feed(db):
+        return (await get_feed_posts_svc(db, limit=50))["posts"]
+
+    assert asyncio.run(count_statements(tmp_path, 50, feed)) == 1